@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+'''Parsing throughput of a batch of large answers against the number of
+parser processes (efilepy.DEFAULT_CONF['parse_workers']). The answers
+are synthesized -U answers, in HTML when BeautifulSoup is available, or
+recorded ones given with --fixture (e.g. the output.html written with
+--debug).'''
+
+import argparse, sys, os, json, time, concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import efilepy
+
+def allver_json(count):
+	return json.dumps(dict(result = [ dict(category = 'cat-{}'.format(i % 7),
+		package = 'pkg{}'.format(i // 4), version = '1.{}'.format(i % 4),
+		path = '/usr/bin', file = 'du', archs = [ 'amd64', 'x86' ],
+		useflags = [], type = [ 'obj' ]) for i in range(count) ]))
+
+def allver_html(count):
+	rows = list()
+	for i in range(count):
+		cp = 'cat-{}/pkg{}'.format(i % 7, i // 4)
+		ver = '1.{}'.format(i % 4)
+		rows.append('<tr><td><a href="/site/packages/{0}">{0}</a></td>'
+				'<td>/usr/bin/du</td><td>obj</td><td>amd64, x86</td>'
+				'<td><a href="/site/packages/{0}/{1}">{1}</a></td>'
+				'<td></td></tr>'.format(cp, ver))
+	return ('<html><body><a id="result"></a><table><tr><th>Package</th>'
+			'<th>Path</th><th>Type</th><th>Arch</th><th>Version</th>'
+			'<th>USE</th></tr>' + '\n'.join(rows) + '</table></body></html>')
+
+def throughput(workers, source, str_raw, answers, jobs):
+	'''Return the answers parsed per second with workers processes.'''
+	query = dict(req_url = '', req_data = None)
+	with efilepy.Session(source = source, cache = False,
+			parse_workers = workers) as session, \
+			concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+		# Start the worker processes outside of the timing
+		session.parse(source, 'allver', query, str_raw)
+		start = time.perf_counter()
+		for result in executor.map(lambda i: session.parse(source, 'allver',
+				query, str_raw), range(answers)):
+			pass
+		return answers / (time.perf_counter() - start)
+
+def main():
+	parser = argparse.ArgumentParser(description = __doc__)
+	parser.add_argument('--fixture', metavar = 'FILE',
+			help = 'recorded -U answer to parse')
+	parser.add_argument('--source', choices = efilepy.SOURCES,
+			help = 'source of the answer, by default pfl_html if '
+			'BeautifulSoup is available')
+	parser.add_argument('--lines', type = int, default = 5000,
+			help = 'lines in the synthesized answer')
+	parser.add_argument('--answers', type = int, default = 32,
+			help = 'answers parsed per measurement')
+	parser.add_argument('--max-workers', type = int,
+			default = os.cpu_count() or 1)
+	args = parser.parse_args()
+
+	source = args.source
+	if not source:
+		try:
+			import bs4
+			source = 'pfl_html'
+		except ImportError:
+			source = 'pfl_json'
+	if args.fixture:
+		with open(args.fixture, 'r', encoding = 'utf-8') as f:
+			str_raw = f.read()
+	elif 'pfl_html' == source:
+		str_raw = allver_html(args.lines)
+	else:
+		str_raw = allver_json(args.lines)
+
+	print('{}, {} KiB per answer, {} CPUs'.format(source, len(str_raw) // 1024,
+		os.cpu_count()))
+	workers = 0
+	base = None
+	while workers <= args.max_workers:
+		rate = throughput(workers, source, str_raw, args.answers,
+				max(workers, 1))
+		base = base or rate
+		print('{:>3} workers{:>10.1f} answers/s{:>8.2f}x'.format(workers, rate,
+			rate / base))
+		workers = workers * 2 if workers else 1
+	return 0
+
+if '__main__' == __name__:
+	sys.exit(main())
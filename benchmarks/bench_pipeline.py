@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+'''Time and peak memory of every stage of a lookup on the fixtures, served
+by the stub server, compared against the baselines stored in
+baselines.json. Exits with 1 and lists the regressions if a stage got
+slower or hungrier than the tolerance allows. Baselines depend on the
+machine; record them with --save-baseline before changing the code.'''
+
+import argparse, sys, os, json, time, tracemalloc, contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import efilepy
+import fixtures
+from stubserver import StubServer
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+		'baselines.json')
+
+STAGES = ('read_result', 'parse_result', 'extra_info', 'sort_result',
+		'output_preprocess', 'print_result')
+
+def pipeline(session, source, mode, args, fmtstr, stage):
+	'''Run a lookup the way e-file-py.py does for text output, with each
+	stage wrapped in the context manager stage(name).'''
+	query = session.make_query(mode, args)
+	with stage('read_result'):
+		str_raw = session.read_result(source, mode, query)
+	with stage('parse_result'):
+		result = session.parse(source, mode, query, str_raw)
+	del str_raw
+	with stage('extra_info'):
+		for cp, cp_group in result.items():
+			session.extra_info(mode, query, cp, cp_group)
+	with stage('sort_result'):
+		result = efilepy.sort_result(result)
+	with stage('output_preprocess'):
+		for cp, cp_group in result:
+			efilepy.output_preprocess(cp, cp_group, fmtstr)
+	with stage('print_result'), open(os.devnull, 'w') as devnull, \
+			contextlib.redirect_stdout(devnull):
+		efilepy.print_result(mode, query, result, fmtstr)
+
+def measure(session, source, mode, args, repeat, memory = True):
+	'''Return {stage: (seconds, peak bytes)}, the best time of repeat runs
+	and the peak allocated on top of what was allocated before the stage,
+	from a separate run under tracemalloc, which is several times slower.
+	The peak is None without memory.'''
+	fmtstr = efilepy.build_fmtstr('e_file_' + mode)
+	times = { name: [] for name in STAGES }
+	peaks = dict.fromkeys(STAGES)
+
+	@contextlib.contextmanager
+	def timed(name):
+		start = time.perf_counter()
+		yield
+		times[name].append(time.perf_counter() - start)
+
+	@contextlib.contextmanager
+	def traced(name):
+		current = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		yield
+		peaks[name] = tracemalloc.get_traced_memory()[1] - current
+
+	for i in range(repeat):
+		pipeline(session, source, mode, args, fmtstr, timed)
+	if memory:
+		tracemalloc.start()
+		try:
+			pipeline(session, source, mode, args, fmtstr, traced)
+		finally:
+			tracemalloc.stop()
+	return { name: (min(times[name]), peaks[name]) for name in STAGES }
+
+def compare(results, baselines, tol_time, tol_mem):
+	'''Return descriptions of the results exceeding their baselines, or
+	lacking one.'''
+	regressions = list()
+	for key, (sec, peak) in sorted(results.items()):
+		if key not in baselines:
+			regressions.append(key + ': no baseline, record one with '
+					'--save-baseline')
+			continue
+		base_sec, base_peak = baselines[key]
+		# Absolute slack keeps stages of microseconds from flapping
+		if sec > base_sec * tol_time + 0.002:
+			regressions.append('{}: {:.2f} ms, baseline {:.2f} ms'.format(key,
+				sec * 1000, base_sec * 1000))
+		if peak is not None and base_peak is not None \
+				and peak > base_peak * tol_mem + 65536:
+			regressions.append('{}: {:.2f} MiB peak, baseline {:.2f} MiB'
+					.format(key, peak / 1048576, base_peak / 1048576))
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description = __doc__)
+	parser.add_argument('names', nargs = '*',
+			help = 'fixtures, by default all of '
+			+ ', '.join(sorted(fixtures.FIXTURES)))
+	parser.add_argument('--source', choices = efilepy.SOURCES,
+			action = 'append', help = 'by default pfl_json, and pfl_html if '
+			'BeautifulSoup is available')
+	parser.add_argument('--latency', type = float, default = 0.0,
+			help = 'server latency in seconds')
+	parser.add_argument('--repeat', type = int, default = 3,
+			help = 'runs per fixture, the best time is kept')
+	parser.add_argument('--no-memory', action = 'store_false',
+			dest = 'memory', help = 'skip the peak memory measurement')
+	parser.add_argument('--baseline', default = BASELINES, metavar = 'FILE')
+	parser.add_argument('--save-baseline', action = 'store_true',
+			help = 'store the results as the baselines instead of comparing')
+	parser.add_argument('--tolerance-time', type = float, default = 1.5,
+			help = 'allowed time, as a multiple of the baseline')
+	parser.add_argument('--tolerance-mem', type = float, default = 1.2,
+			help = 'allowed peak memory, as a multiple of the baseline')
+	args = parser.parse_args()
+	for name in args.names:
+		if name not in fixtures.FIXTURES:
+			parser.error('unknown fixture: ' + name)
+
+	sources = args.source
+	if not sources:
+		sources = [ 'pfl_json' ]
+		try:
+			import bs4
+			sources.append('pfl_html')
+		except ImportError:
+			print('BeautifulSoup not available, skipping pfl_html',
+					file = sys.stderr)
+	results = dict()
+	for source in sources:
+		for name in args.names or sorted(fixtures.FIXTURES):
+			mode, query_args, lines = fixtures.FIXTURES[name]
+			with StubServer({ '': fixtures.load(source, name) },
+					latency = args.latency) as stub, \
+					efilepy.Session(source = source, base_url = stub.base_url,
+					cache = False) as session:
+				for stage, value in measure(session, source, mode, query_args,
+						args.repeat, args.memory).items():
+					results['{}/{}/{}'.format(source, name, stage)] = value
+
+	try:
+		with open(args.baseline, 'r') as f:
+			baselines = json.load(f)
+	except FileNotFoundError:
+		baselines = dict()
+	print('{:<36}{:>12}{:>12}{:>12}'.format('', 'ms', 'MiB peak',
+		'baseline ms'))
+	for key, (sec, peak) in sorted(results.items()):
+		print('{:<36}{:>12.2f}{:>12}{:>12}'.format(key, sec * 1000,
+			'-' if peak is None else '{:.2f}'.format(peak / 1048576),
+			'{:.2f}'.format(baselines[key][0] * 1000)
+			if key in baselines else '-'))
+	if args.save_baseline:
+		for key, (sec, peak) in results.items():
+			# Keep the stored peak of a run without memory measurement
+			if peak is None and key in baselines:
+				peak = baselines[key][1]
+			baselines[key] = (sec, peak)
+		with open(args.baseline, 'w') as f:
+			json.dump(baselines, f, indent = '\t', sort_keys = True)
+			f.write('\n')
+		print('Baselines saved to ' + args.baseline)
+		return 0
+	regressions = compare(results, baselines, args.tolerance_time,
+			args.tolerance_mem)
+	if regressions:
+		print('\nREGRESSION', file = sys.stderr)
+		for line in regressions:
+			print('  ' + line, file = sys.stderr)
+		return 1
+	return 0
+
+if '__main__' == __name__:
+	sys.exit(main())
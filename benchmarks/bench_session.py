@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+'''Per-call cost of a lookup through a new e-file-py process, compared to
+a warm efilepy.Session with and without the response cache.'''
+
+import argparse, sys, os, json, time, tempfile, subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import efilepy
+from stubserver import StubServer
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), 'e-file-py.py')
+
+def ftocpv_json(count):
+	return json.dumps(dict(result = [ dict(category = 'cat-{}'.format(i % 7),
+		package = 'pkg{}'.format(i), version = '1.{}'.format(i),
+		path = '/usr/bin', file = 'du', archs = [ 'amd64', 'x86' ],
+		useflags = [], type = [ 'obj' ]) for i in range(count) ])
+		).encode('utf-8')
+
+def timeit(func, calls):
+	start = time.perf_counter()
+	for i in range(calls):
+		func()
+	return (time.perf_counter() - start) / calls
+
+def main():
+	parser = argparse.ArgumentParser(description = __doc__)
+	parser.add_argument('--calls', type = int, default = 200)
+	parser.add_argument('--cold-calls', type = int, default = 10)
+	parser.add_argument('--packages', type = int, default = 20,
+			help = 'packages in the canned response')
+	parser.add_argument('--latency', type = float, default = 0.0,
+			help = 'server latency in seconds')
+	args = parser.parse_args()
+
+	with StubServer({ '': ftocpv_json(args.packages) },
+			latency = args.latency) as stub, \
+			tempfile.TemporaryDirectory() as cache_dir:
+		cmd = [ sys.executable, CLI, '--source', 'pfl_json', '--base-url',
+				stub.base_url, '--no-cache', '--output', 'json', 'du' ]
+		results = [ ('new process per call', timeit(
+			lambda: subprocess.run(cmd, check = True,
+				stdout = subprocess.DEVNULL), args.cold_calls)) ]
+		with efilepy.Session(source = 'pfl_json', base_url = stub.base_url,
+				cache = False) as session:
+			results.append(('warm Session, no cache', timeit(
+				lambda: session.find_file('du'), args.calls)))
+		with efilepy.Session(source = 'pfl_json', base_url = stub.base_url,
+				cache_dir = cache_dir) as session:
+			results.append(('warm Session, cached', timeit(
+				lambda: session.find_file('du'), args.calls)))
+	for name, sec in results:
+		print('{:<28}{:>10.3f} ms/call'.format(name, sec * 1000))
+
+if '__main__' == __name__:
+	main()
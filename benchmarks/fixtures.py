@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+'''PFL answers used by the benchmarks. A recorded answer in fixtures/ is
+used if there is one; otherwise an answer of the same shape and size is
+generated, deterministically, so that runs on different machines parse
+the same input. Run this file to record the answers from the live
+server:
+
+  python3 benchmarks/fixtures.py --record'''
+
+import argparse, sys, os, json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import efilepy
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+		'fixtures')
+
+# name: (mode, query arguments, lines of the generated answer)
+FIXTURES = dict(
+		tiny = ('uniq', [ 'e-file-py.py' ], 1),
+		uniq = ('uniq', [ 'du' ], 40),
+		allver = ('allver', [ 'libc.so.6' ], 20000),
+		cpvtof = ('cpvtof', [ 'sys-kernel', 'gentoo-sources', '3.10.7' ],
+			100000),
+)
+
+def fixture_path(source, name):
+	return os.path.join(FIXTURES_DIR, '{}-{}'.format(source, name))
+
+def generated_rows(mode, args, lines):
+	'''Yield (category, package, version, dir, file, type, archs, use) of
+	the generated answer.'''
+	archs = [ 'alpha', 'amd64', 'arm', 'hppa', 'ia64', 'ppc', 'x86' ]
+	if 'cpvtof' == mode:
+		c, p, ver = args
+		for i in range(lines):
+			yield (c, p, ver, '/usr/src/linux-{}/dir{}/sub{}'.format(ver,
+				i // 1000, i // 50 % 20), 'file{}.c'.format(i), 'obj',
+				archs[:i % 7 + 1], [ 'symlink' ] if i % 3 else [])
+	else:
+		dirs = [ '/bin', '/usr/bin', '/lib64', '/usr/lib64', '/usr/lib32',
+				'/opt/bin' ]
+		for i in range(lines):
+			yield ('cat-{}'.format(i % 23), 'pkg{}'.format(i // 8 % 2500),
+				'{}.{}.{}'.format(i % 5, i // 5 % 13, i % 3), dirs[i % 6],
+				args[0], 'sym' if i % 4 else 'obj', archs[:i % 7 + 1],
+				[ 'static-libs' ] if i % 5 else [])
+
+def generate_json(mode, args, lines):
+	return json.dumps(dict(result = [ dict(category = c, package = p,
+		version = ver, path = d, file = f, type = [ t ], archs = a,
+		useflags = u) for c, p, ver, d, f, t, a, u
+		in generated_rows(mode, args, lines) ]))
+
+def generate_html(mode, args, lines):
+	rows = list()
+	for c, p, ver, d, f, t, a, u in generated_rows(mode, args, lines):
+		cp = c + '/' + p
+		cells = [ d + '/' + f, t, ', '.join(a), ', '.join(u) ]
+		if 'cpvtof' != mode:
+			cells.insert(0, '<a href="/site/packages/{0}">{0}</a>'.format(cp))
+		if 'allver' == mode:
+			cells.insert(4, '<a href="/site/packages/{0}/{1}">{1}</a>'.format(
+				cp, ver))
+		rows.append('<tr>' + ''.join('<td>{}</td>'.format(cell)
+			for cell in cells) + '</tr>')
+	return ('<html><body><a id="result"></a>\n<table>\n<tr><th></th></tr>\n'
+			+ '\n'.join(rows) + '\n</table>\n</body></html>\n')
+
+def load(source, name):
+	'''Return the answer of fixture name in source, as bytes.'''
+	try:
+		with open(fixture_path(source, name), 'rb') as f:
+			return f.read()
+	except FileNotFoundError:
+		pass
+	mode, args, lines = FIXTURES[name]
+	generate = generate_html if 'pfl_html' == source else generate_json
+	return generate(mode, args, lines).encode('utf-8')
+
+def record(sources, names):
+	'''Fetch the fixtures from the server into FIXTURES_DIR.'''
+	os.makedirs(FIXTURES_DIR, exist_ok = True)
+	with efilepy.Session(cache = False) as session:
+		for source in sources:
+			for name in names:
+				mode, args, lines = FIXTURES[name]
+				query = session.make_query(mode, args)
+				str_raw = session.read_result(source, mode, query)
+				with open(fixture_path(source, name), 'w',
+						encoding = 'utf-8') as f:
+					f.write(str_raw)
+				print('{}: {} bytes'.format(fixture_path(source, name),
+					len(str_raw)))
+
+def main():
+	parser = argparse.ArgumentParser(description = __doc__,
+			formatter_class = argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--record', action = 'store_true',
+			help = 'record the answers from the server')
+	parser.add_argument('--source', choices = efilepy.SOURCES,
+			action = 'append')
+	parser.add_argument('names', nargs = '*',
+			help = 'fixtures, by default all of ' + ', '.join(sorted(FIXTURES)))
+	args = parser.parse_args()
+	for name in args.names:
+		if name not in FIXTURES:
+			parser.error('unknown fixture: ' + name)
+	sources = args.source or efilepy.SOURCES
+	names = args.names or sorted(FIXTURES)
+	if args.record:
+		record(sources, names)
+		return 0
+	for source in sources:
+		for name in names:
+			print('{}-{}: {} bytes{}'.format(source, name,
+				len(load(source, name)),
+				', recorded' if os.path.exists(fixture_path(source, name))
+				else ''))
+	return 0
+
+if '__main__' == __name__:
+	sys.exit(main())
@@ -0,0 +1,71 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# A local HTTP server standing in for portagefilelist.de in benchmarks and
+# tests.
+
+import http.server, threading, gzip, time
+
+class StubServer:
+	'''Serve canned responses on 127.0.0.1 from a background thread.
+	responses maps a request path, query string included, to the body
+	bytes, or to (status, body bytes); every other path gets the response
+	of the '' key or a 404. latency delays every response, so a latency
+	longer than the read timeout of the client stands in for a server
+	that never answers.'''
+
+	def __init__(self, responses, latency = 0.0, port = 0):
+		self.responses = responses
+		self.latency = latency
+		self.requests = 0
+		stub = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			disable_nagle_algorithm = True
+
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				stub.requests += 1
+				if stub.latency:
+					time.sleep(stub.latency)
+				body = stub.responses.get(self.path,
+						stub.responses.get(''))
+				status = 200
+				if body is None:
+					status, body = 404, b''
+				elif isinstance(body, tuple):
+					status, body = body
+				if not body:
+					self.send_response(status)
+					self.send_header('Content-Length', '0')
+					self.end_headers()
+					return
+				self.send_response(status)
+				if 'gzip' in self.headers.get('Accept-Encoding', ''):
+					body = gzip.compress(body, 1)
+					self.send_header('Content-Encoding', 'gzip')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def do_POST(self):
+				self.rfile.read(int(self.headers.get('Content-Length', 0)))
+				self.do_GET()
+
+		self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port),
+				Handler)
+		self.httpd.daemon_threads = True
+		self.base_url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+
+	def __enter__(self):
+		threading.Thread(target = self.httpd.serve_forever,
+				daemon = True).start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.httpd.shutdown()
+		self.httpd.server_close()
@@ -0,0 +1,22 @@
+# bash completion of e-file-py
+# Source this file, or install it as
+# /usr/share/bash-completion/completions/e-file-py
+
+_e_file_py() {
+	local cur kind=file word
+	cur=${COMP_WORDS[COMP_CWORD]}
+	if [[ ${cur} == -* ]]; then
+		kind=options
+	else
+		for word in "${COMP_WORDS[@]:1:COMP_CWORD-1}"; do
+			case ${word} in
+				-l|--list-files) kind=cpv ;;
+				-L|--list-versions|-D|--diff|-A|--audit) kind=cp ;;
+			esac
+		done
+	fi
+	local IFS=$'\n'
+	COMPREPLY=( $("${COMP_WORDS[0]}" --complete ${kind} "${cur}" \
+		2>/dev/null) )
+}
+complete -F _e_file_py e-file-py e-file-py.py e-file
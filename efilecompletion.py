@@ -0,0 +1,124 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# Shell completion of e-file-py. Completions are answered from sorted
+# tables on disk by binary search over a memory map, without loading
+# efilepy or Portage, so that a tab press costs little more than the
+# interpreter startup. The tables are built by
+# efilepy.Session.completion_rebuild().
+
+import sys, os, mmap, json, time, subprocess
+
+# Same as efilepy.DEFAULT_CONF['cache_dir']
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME')
+		or os.path.expanduser('~/.cache'), 'e-file-py')
+
+# Completion kinds and the tables searched for them:
+#   cp: category/package from the Portage tree, and bare package names
+#   cpv: category/package-version from the Portage tree and installed
+#   file: names of installed files and previously looked up files
+#   options: option strings of the command line interface
+KINDS = dict(
+		cp = ('cp', 'pn'),
+		cpv = ('cpv', 'installed'),
+		file = ('files', ),
+		options = ('options', ),
+)
+
+def table_dir(cache_dir = CACHE_DIR):
+	return os.path.join(cache_dir, 'completion')
+
+def table_write(path, lines):
+	'''Write lines sorted and without duplicates, atomically.'''
+	with open(path + '.tmp', 'w', encoding = 'utf-8') as f:
+		for line in sorted(set(lines)):
+			f.write(line + '\n')
+	os.replace(path + '.tmp', path)
+
+def prefix_search(path, prefix, limit = None):
+	'''Return the lines of the sorted table path starting with prefix.'''
+	prefix_b = prefix.encode('utf-8')
+	matches = list()
+	try:
+		f = open(path, 'rb')
+	except OSError:
+		return matches
+	with f:
+		size = os.fstat(f.fileno()).st_size
+		if not size:
+			return matches
+		with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+			# lo and hi are line starts; lines before lo sort before
+			# prefix, lines from hi on do not
+			lo, hi = 0, size
+			while lo < hi:
+				mid = (lo + hi) // 2
+				start = m.rfind(b'\n', 0, mid) + 1
+				end = m.find(b'\n', start)
+				if -1 == end:
+					end = size
+				if m[start:end] < prefix_b:
+					lo = end + 1
+				else:
+					hi = start
+			while lo < size and (limit is None or len(matches) < limit):
+				end = m.find(b'\n', lo)
+				if -1 == end:
+					end = size
+				line = m[lo:end]
+				if not line.startswith(prefix_b):
+					break
+				matches.append(line.decode('utf-8', 'replace'))
+				lo = end + 1
+	return matches
+
+def complete(kind, prefix, cache_dir = CACHE_DIR, limit = 200):
+	'''Return the sorted completions of prefix.'''
+	matches = set()
+	for table in KINDS[kind]:
+		matches.update(prefix_search(os.path.join(table_dir(cache_dir),
+			table), prefix, limit))
+	return sorted(matches)[:limit]
+
+def stale(cache_dir = CACHE_DIR):
+	'''Return whether the tables are missing or any of the files they
+	were built from (recorded by the builder) changed since.'''
+	try:
+		with open(os.path.join(table_dir(cache_dir), 'stamps.json'),
+				'r') as f:
+			watch = json.load(f)['watch']
+	except (OSError, ValueError, KeyError):
+		return True
+	for path, mtime in watch.items():
+		try:
+			if os.stat(path).st_mtime != mtime:
+				return True
+		except OSError:
+			if mtime is not None:
+				return True
+	return False
+
+def rebuilding(cache_dir = CACHE_DIR):
+	'''Return whether a rebuild is running, judging by a marker file
+	that is not older than an hour.'''
+	try:
+		return time.time() - os.stat(os.path.join(table_dir(cache_dir),
+			'rebuilding')).st_mtime < 3600
+	except OSError:
+		return False
+
+def main(argv, script):
+	'''Handle e-file-py.py --complete KIND PREFIX. A stale table is
+	still used, while a rebuild is started in the background.'''
+	if not argv or argv[0] not in KINDS:
+		print('usage: {} --complete {{{}}} [PREFIX]'.format(script,
+			','.join(sorted(KINDS))), file = sys.stderr)
+		return 2
+	for match in complete(argv[0], argv[1] if 1 < len(argv) else ''):
+		print(match)
+	if stale() and not rebuilding():
+		subprocess.Popen([ sys.executable, script, '--complete-rebuild' ],
+				stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL,
+				stderr = subprocess.DEVNULL, start_new_session = True)
+	return 0
@@ -0,0 +1,2385 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# The e-file-py library. e-file-py.py is the command line interface on
+# top of it; other programs can use a Session directly:
+#
+#   import efilepy
+#   with efilepy.Session(source = 'pfl_json') as session:
+#       session.find_file('du')
+
+import urllib.request, urllib.parse, sys, os, functools, gzip
+import http.client, time, random, json, hashlib, zlib
+import threading, logging, collections, copy, socket, contextlib, re, bisect
+import struct, mmap, glob
+import concurrent.futures, multiprocessing
+
+try: import portage
+except ImportError: pass
+
+import efilecompletion
+
+# Exceptions
+
+class Error(Exception):
+	'''Base class of all errors raised by e-file-py.'''
+
+class QueryError(Error):
+	'''Raised when the query could not be understood.'''
+
+class FetchError(Error):
+	'''Raised when a request to the server could not be completed.'''
+	def __init__(self, msg, retriable = True):
+		super().__init__(msg)
+		self.retriable = retriable
+
+class ServerError(Error):
+	'''Raised when the server reports a failure.'''
+
+class ParseError(ServerError):
+	'''Raised when the answer of the server could not be understood.'''
+
+# Helper functions
+
+# http://stackoverflow.com/a/1695250
+def enum_build(*sequential, **named):
+    enums = dict(zip(sequential, range(len(sequential))), **named)
+    return type('Enum', (), enums)
+
+logger = logging.getLogger('efilepy')
+# Quiet unless the application configures logging
+logger.addHandler(logging.NullHandler())
+
+def report(level, msg):
+	'''Logging function.'''
+	logger.log(LOGLEVELS_LOGGING[level], msg)
+	return 0
+
+def sys_detect():
+	if 'portage' in sys.modules:
+		return 'gentoo'
+	return None
+
+def commasplit(str_src):
+	return [ item.strip() for item
+			in str_src.split(',') if item.strip() ]
+
+def cache_key(url, data):
+	h = hashlib.sha1(url.encode('utf-8'))
+	if data:
+		h.update(b'\0' + data)
+	return h.hexdigest()
+
+def plist_getver(plist):
+	return [ portage.versions.cpv_getversion(p) for p in plist ]
+
+def get_vercmp_func():
+	if 'gentoo' == system:
+		return portage.versions.vercmp
+	else:
+		return (lambda a, b: (a > b) - 0.5)
+
+def ver_validate(ver):
+	# Ugly hack to deal with some broken package versions
+	# PFL reports
+	if '.' == ver[-1]:
+		ver = ver[:-1]
+	if 'gentoo' == system and not portage.versions.ververify(ver):
+		report(LOGLEVELS.warning, 'Invalid version number: {}'.format(ver))
+		ver = '0'
+	return ver
+
+# Default configurations
+
+LOGLEVELS_STRS = ('fatal', 'warning', 'info', 'debug')
+LOGLEVELS = enum_build(*LOGLEVELS_STRS)
+LOGLEVELS_LOGGING = (logging.CRITICAL, logging.WARNING, logging.INFO,
+		logging.DEBUG)
+
+SOURCES = ('pfl_html', 'pfl_json')
+
+OUTPUTS = ('text', 'json', 'ndjson')
+
+PREDEF_FMTSTR = dict(
+		base = dict(
+			lvcp = '',
+			lvver = '',
+			lvpath = '',
+			sep_lvcp = '\n',
+			sep_lvver = '',
+			sep_lvpath = '',
+			sep = ', ',
+			sym_ = ' * ',
+			sym_installed = '[I]',
+			sym_upgrade = '[U]',
+			sym_downgrade = '[D]',
+			prefix_installed = '\033[0;32m\033[7m',
+			suffix_installed = '\033[0m',
+			prefix_available = '\033[0;44m',
+			suffix_available = '\033[0m',
+			prefix_matched = '\033[0;44m',
+			suffix_matched = '\033[0m',
+			prefix_exists = '\033[0;32m\033[7m',
+			suffix_exists = '\033[0m',
+			repr_true_exists = 'Exists',
+			repr_false_exists = 'Does not exist',
+			repr_empty_installed = 'Not installed',
+			repr_empty_ver_installed = '[ Not Installed ]',
+			repr_empty_ver_available = '[ Not Available ]',
+			repr_empty_ver_all = '[ No Information ]',
+			repr_empty_ver = '[ No Information ]',
+			noresult = 'Sorry, no results found.\n',
+		),
+		e_file_uniq = dict(
+			lvcp = '{symbol} {c}/\033[1m{p}\033[0m\n'
+			'{lvcp_sub_aux_if_ver_available}'
+			'{lvcp_sub_inst_if_ver_installed}'
+			'\033[0;32m     Link to PFL file list:\033[0m\t{cp_pfl}\n'
+			'\033[0;32m     All matched files:\033[0m\t\t{path_all_str_hl}\n',
+			lvcp_sub_aux_if_ver_available = 
+			'\033[0;32m     Homepage:\033[0m\t\t\t{homepage}\n'
+			'\033[0;32m     Description:\033[0m\t\t{description}\n'
+			'\033[0;32m     Available versions:\033[0m\t{ver_available_str_hl}\n',
+			lvcp_sub_inst_if_ver_installed = 
+			'\033[0;32m     Installed versions:\033[0m\t{ver_installed_str_hl}\n',
+			),
+		e_file_allver = dict(
+			lvcp = '{symbol} {c}/\033[1m{p}\033[0m\n'
+			'{lvcp_sub_aux_if_ver_available}'
+			'{lvcp_sub_inst_if_ver_installed}'
+			'\033[0;32m     All matched versions:\033[0m\t{ver_all_str_hl}\n'
+			'\n{lvver}',
+			lvver = '\033[0;32m     File found in version:\033[0m\t{lvver_ver_hl}{lvver_symbol}\n'
+			'\033[0;32m     Link to PFL file list of the version:\033[0m\t{lvver_ver_pfl}\n'
+			'\033[0;32m     All matched files:\033[0m\t\t{path_all_str_hl}\n',
+			sep_lvver = '\n',
+			lvcp_sub_aux_if_ver_available = 
+			'\033[0;32m     Homepage:\033[0m\t\t\t{homepage}\n'
+			'\033[0;32m     Description:\033[0m\t\t{description}\n'
+			'\033[0;32m     Available versions:\033[0m\t{ver_available_str_hl}\n',
+			lvcp_sub_inst_if_ver_installed = 
+			'\033[0;32m     Installed versions:\033[0m\t{ver_installed_str_hl}\n',
+		),
+		e_file_cptov = dict(
+			lvcp = '{lvver}',
+			lvver = '{lvver_ver_hl}\n',
+		),
+		e_file_cpvtof = dict(
+			lvcp = '{lvver}',
+			lvver = '{lvpath}',
+			lvpath = '{lvpath_path_hl}\n',
+		),
+		full_uniq = dict(
+			lvcp = '{symbol} {c}/\033[1m{p}\033[0m\n'
+			'\033[0;32m     Homepage:\033[0m\t\t\t{homepage}\n'
+			'\033[0;32m     Description:\033[0m\t\t{description}\n'
+			'\033[0;32m     Link to PFL file list:\033[0m\t{cp_pfl}\n'
+			'\033[0;32m     Available versions:\033[0m\t{ver_available_str_hl}\n'
+			'\033[0;32m     Installed versions:\033[0m\t{ver_installed_str_hl}\n'
+			'\033[0;32m     All matched files:\033[0m\t\t{path_all_str_hl}\n'
+			'\n{lvver}',
+			lvver = '{lvpath}',
+			lvpath = '\033[0;32m     Matched file:\033[0m\t\t{lvpath_path_hl}\n'
+			'\033[0;32m     File found with USE flag:\033[0m\t{lvpath_use_str}\n'
+			'\033[0;32m     File found in arch:\033[0m\t{lvpath_arch_str}\n',
+			sep_lvpath = '\n',
+		),
+		full_allver = dict(
+			lvcp = '{symbol} {c}/\033[1m{p}\033[0m\n'
+			'\033[0;32m     Homepage:\033[0m\t\t\t{homepage}\n'
+			'\033[0;32m     Description:\033[0m\t\t{description}\n'
+			'\033[0;32m     Link to PFL file list:\033[0m\t{cp_pfl}\n'
+			'\033[0;32m     Available versions:\033[0m\t{ver_available_str_hl}\n'
+			'\033[0;32m     Installed versions:\033[0m\t{ver_installed_str_hl}\n'
+			'\n{lvver}',
+			lvver = '\033[0;32m     File found in version:\033[0m\t{lvver_ver_hl}{lvver_symbol}\n'
+			'\033[0;32m     All matched files:\033[0m\t\t{lvver_path_all_str_hl}\n'
+			'\033[0;32m     Link to PFL file list of the version:\033[0m\t{lvver_ver_pfl}\n'
+			'{lvpath}',
+			sep_lvver = '\033[0;32m     -------------------\033[0m\n',
+			lvpath = '\033[0;32m     Matched file:\033[0m\t\t{lvpath_path_hl}\n'
+			'\033[0;32m     File exists locally?:\033[0m\t{lvpath_exists_str}\n'
+			'\033[0;32m     File found with USE flag:\033[0m\t{lvpath_use_str}\n'
+			'\033[0;32m     File found in arch:\033[0m\t{lvpath_arch_str}\n',
+			sep_lvpath = '\n',
+		),
+		full_cptov = dict(
+			lvcp = '{symbol} {c}/\033[1m{p}\033[0m\n'
+			'\033[0;32m     Homepage:\033[0m\t\t\t{homepage}\n'
+			'\033[0;32m     Description:\033[0m\t\t{description}\n'
+			'\033[0;32m     Link to PFL file list:\033[0m\t{cp_pfl}\n'
+			'\033[0;32m     Available versions:\033[0m\t{ver_available_str_hl}\n'
+			'\033[0;32m     Installed versions:\033[0m\t{ver_installed_str_hl}\n'
+			'\n{lvver}',
+			lvver = '\033[0;32m     Version:\033[0m\t{lvver_ver_hl}{lvver_symbol}\n'
+			'\033[0;32m     Link to PFL file list of the version:\033[0m\t{lvver_ver_pfl}\n'
+			'{lvpath}',
+			sep_lvver = '\n',
+		),
+		full_cpvtof = dict(
+			lvcp = '{symbol} {c}/\033[1m{p}\033[0m\n'
+			'\033[0;32m     Homepage:\033[0m\t\t\t{homepage}\n'
+			'\033[0;32m     Description:\033[0m\t\t{description}\n'
+			'\033[0;32m     Available versions:\033[0m\t{ver_available_str_hl}\n'
+			'\033[0;32m     Installed versions:\033[0m\t{ver_installed_str_hl}\n'
+			'\n{lvver}',
+			lvver = '\033[0;32m     File found in version:\033[0m\t{lvver_ver_hl}{lvver_symbol}\n'
+			'\033[0;32m     Link to PFL file list of the version:\033[0m\t{lvver_ver_pfl}\n'
+			'\n{lvpath}',
+			lvpath = '\033[0;32m     Matched file:\033[0m\t\t{lvpath_path_hl}\n'
+			'\033[0;32m     File exists locally?:\033[0m\t{lvpath_exists_str}\n'
+			'\033[0;32m     File found with USE flag:\033[0m\t{lvpath_use_str}\n'
+			'\033[0;32m     File found in arch:\033[0m\t{lvpath_arch_str}\n',
+			sep_lvpath = '\n',
+		),
+		raw_uniq = dict(
+				lvcp = '{cp}\n',
+				sep_lvcp = '',
+		),
+		raw_allver = dict(
+				lvcp = '{lvver}',
+				sep_lvcp = '',
+				lvver = '{lvver_cpv}\n',
+		),
+		raw_cptov = dict(
+			lvcp = '{lvver}',
+			lvver = '{ver}\n',
+		),
+		raw_cpvtof = dict(
+			lvcp = '{lvver}',
+			lvver = '{lvpath}',
+			lvpath = '{path}\n',
+		),
+)
+DEFAULT_CONF = dict(
+		debug = False,
+		base_url = 'http://www.portagefilelist.de',
+		minimal = False,
+		source = 'pfl_html',
+		output = 'text',
+		# Network behaviour. Timeouts and the deadline are in seconds;
+		# the deadline covers all retries of a single query.
+		timeout_connect = 10.0,
+		timeout_read = 30.0,
+		deadline = 90.0,
+		retries = 3,
+		retry_backoff = 0.5,
+		retry_backoff_max = 10.0,
+		max_redirects = 5,
+		# Bytes of a single answer; -l of a kernel source package is
+		# over 20 MB
+		max_size = 256000000,
+		# Consecutive failed queries before the circuit breaker opens, and
+		# the time it stays open before a single probe request is allowed
+		breaker_threshold = 5,
+		breaker_cooldown = 300.0,
+		# Response cache. Stale entries are still used as a fallback
+		# when the server can not be reached.
+		cache = True,
+		cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME')
+			or os.path.expanduser('~/.cache'), 'e-file-py'),
+		cache_ttl = 86400.0,
+		# Responses kept in memory by a Session, and idle keep-alive
+		# connections kept per server
+		mem_cache_size = 256,
+		pool_size = 8,
+		# Concurrent requests of bulk operations
+		jobs = 8,
+		# Worker processes parsing answers, 0 to parse in the calling
+		# thread. Parsing HTML is CPU bound and serialized by the GIL
+		# otherwise.
+		parse_workers = 0,
+		# Lookups remembered for the cache warmer, and its default time
+		# (seconds) and download (bytes) budget
+		history_size = 1000,
+		warm_time = 600.0,
+		warm_bytes = 50000000,
+		# File the metrics are written to in the Prometheus text format
+		# when the Session is closed
+		metrics_file = None,
+		# Relative to base_url
+		req_url = dict(
+			pfl_html = dict(
+				uniq = '/site/query/file/?do',
+				allver = '/site/query/file/?do',
+				cpvtof = '/site/query/listPackageFiles/?category={c}&package={p}&version={v}&do',
+				cptov = '/site/query/listPackageVersions/?category={c}&package={p}&do',
+				),
+			pfl_json = dict(
+				uniq = '/site/query/robotFile?file={filename}&unique_packages',
+				allver = '/site/query/robotFile?file={filename}',
+				cpvtof = '/site/query/robotListPackageFiles?category={c}&package={p}&version={v}',
+				cptov = '/site/query/robotListPackageVersions?category={c}&package={p}'
+				),
+		),
+		req_data = dict(
+			pfl_html = dict(
+				allver = dict(file = '{filename}'),
+				uniq = dict(file = '{filename}', unique_packages = 'on'),
+				cpvtof = None,
+				cptov = None,
+				),
+			pfl_json = dict(
+				allver = None,
+				uniq = None,
+				cpvtof = None,
+				cptov = None,
+				),
+		),
+)
+
+# Global variables
+
+system = sys_detect()
+vercmp_func = get_vercmp_func()
+
+# Sort keys
+def sort_key_tuple_first(path_group_tuple):
+	return path_group_tuple[0]
+
+def sort_key_ver_group(ver_group_tuple):
+	return functools.cmp_to_key(vercmp_func)(ver_group_tuple[0])
+
+sort_key_path_group = sort_key_cp_group = sort_key_tuple_first
+
+sort_key_ver = functools.cmp_to_key(vercmp_func)
+
+# Core functions
+
+def parse_result(source, mode, query, str_raw,
+		base_url = DEFAULT_CONF['base_url']):
+	def default_cp_get():
+		return query['cp']
+
+	def default_cp():
+		pass
+
+	def default_ver_get():
+		return query['v']
+
+	def default_ver():
+		pass
+
+	def default_path_get():
+		return '/dev/null'
+
+	def default_path():
+		pass
+
+	def ftocpv_cp_get():
+		if 'pfl_html' == source:
+			return ele_td_lst[0].get_text()
+		elif 'pfl_json' == source:
+			return jele['category'] + '/' + jele['package']
+
+	def ftocpv_cp():
+		v = ''
+		if 'pfl_html' == source:
+			v = base_url + ele_td_lst[0].a['href']
+		cp_group['cp_pfl'] = v
+	
+	def ftocpv_ver_get():
+		if 'uniq' == mode:
+			return ''
+		elif 'allver' == mode:
+			if 'pfl_html' == source:
+				return ver_validate(ele_td_lst[4].get_text())
+			elif 'pfl_json' == source:
+				return ver_validate(jele['version'])
+
+	def ftocpv_ver():
+		v = ''
+		if 'pfl_html' == source and 'allver' == mode:
+			v = base_url + ele_td_lst[4].a['href']
+		ver_group['ver_pfl'] = v
+
+	def ftocpv_path_get():
+		if 'pfl_html' == source:
+			return ele_td_lst[1].get_text()
+		elif 'pfl_json' == source:
+			return jele['path'] + '/' + jele['file']
+
+	def ftocpv_path():
+		if 'pfl_html' == source:
+			path_group['type'] = commasplit(ele_td_lst[2].get_text())
+			path_group['arch'] = commasplit(ele_td_lst[3].get_text())
+			if 'uniq' == mode:
+				path_group['use'] = commasplit(ele_td_lst[4].get_text())
+			elif 'allver' == mode:
+				path_group['use'] = commasplit(ele_td_lst[5].get_text())
+		elif 'pfl_json' == source:
+			path_group['type'] = jele.get('type', list())
+			path_group['arch'] = jele.get('archs', list())
+			path_group['use'] = jele.get('useflags', list())
+	
+	def cpvtof_ver():
+		ver_group['ver_pfl'] = query['req_url']
+
+	def cpvtof_path_get():
+		if 'pfl_html' == source:
+			return ele_td_lst[0].get_text()
+		elif 'pfl_json' == source:
+			return jele['path'] + '/' + jele['file']
+
+	def cpvtof_path():
+		if 'pfl_html' == source:
+			path_group['type'] = commasplit(ele_td_lst[1].get_text())
+			path_group['arch'] = commasplit(ele_td_lst[2].get_text())
+			path_group['use'] = commasplit(ele_td_lst[3].get_text())
+		elif 'pfl_json' == source:
+			path_group['type'] = jele.get('type', list())
+			path_group['arch'] = jele.get('archs', list())
+			path_group['use'] = jele.get('useflags', list())
+
+	def cptov_cp():
+		if 'pfl_html' == source:
+			cp_group['cp_pfl'] = query['req_url']
+		return ''
+
+	def cptov_ver_get():
+		if 'pfl_html' == source:
+			return ele_td_lst[0].get_text()
+		elif 'pfl_json' == source:
+			return jele['version']
+
+	def cptov_ver():
+		if 'pfl_html' == source:
+			ver_group['ver_pfl'] = base_url + ele_td_lst[0].a['href']
+		return ''
+
+	def parse_ele():
+		nonlocal cp_group, ver_group, path_group
+		cp = parse_func['cp_get']()
+		if cp not in result:
+			result[cp] = dict()
+			cp_group = result[cp]
+			cp_group['ver_groups'] = dict()
+			cp_group['c'], cp_group['p'] = cp.split('/', 1)
+			parse_func['cp']()
+		cp_group = result[cp]
+		ver = parse_func['ver_get']()
+		if ver not in cp_group['ver_groups']:
+			cp_group['ver_groups'][ver] = dict()
+			ver_group = cp_group['ver_groups'][ver]
+			ver_group['path_groups'] = dict()
+			ver_group['cpv'] = cp + '-' + ver
+			parse_func['ver']()
+		ver_group = cp_group['ver_groups'][ver]
+		path = parse_func['path_get']()
+		if path not in ver_group['path_groups']:
+			ver_group['path_groups'][path] = dict()
+			path_group = ver_group['path_groups'][path]
+			parse_func['path']()
+
+	result = dict()
+	parse_func = dict()
+	cp_group = ver_group = path_group = None
+	if mode in ('uniq', 'allver'):
+		prefix = 'ftocpv_'
+	else:
+		prefix = mode + '_'
+	for i in ('cp', 'ver', 'path'):
+		for j in ('', '_get'):
+			parse_func[i + j] = locals().get(prefix + i + j,
+					locals()['default_' + i + j])
+	if 'pfl_html' == source:
+		import bs4
+		soup = bs4.BeautifulSoup(str_raw, 'html')
+		ele_a_result = soup.find('a', id = 'result')
+		if not ele_a_result:
+			raise ParseError('No result found in the answer of the server.')
+		ele_table = [ ele for ele in ele_a_result.next_siblings
+				if isinstance(ele, bs4.element.Tag)
+				and 'table' == ele.name.lower() ]
+		if not ele_table:
+			raise ParseError('No result table found in the answer of the '
+					'server.')
+		ele_table = ele_table[0]
+		try:
+			for ele_tr in ele_table.children:
+				if not (isinstance(ele_tr, bs4.element.Tag)
+						and 'tr' == ele_tr.name.lower()):
+					continue
+				ele_td_lst = ele_tr.find_all('td')
+				if not ele_td_lst:
+					continue
+				if 'colspan' in ele_td_lst[0].attrs:
+					# No results found
+					break
+				parse_ele()
+		except (IndexError, KeyError, TypeError, AttributeError, ValueError) \
+				as e:
+			raise ParseError('Malformed result table: {}: {}'.format(
+				type(e).__name__, e))
+	elif 'pfl_json' == source:
+		import json
+		try:
+			jsonout = json.loads(str_raw)
+		except ValueError as e:
+			raise ParseError('Malformed JSON answer: ' + str(e))
+		if not isinstance(jsonout, dict):
+			raise ParseError('Malformed JSON answer: not an object')
+		if isinstance(jsonout.get('error'), dict) \
+				and jsonout['error'].get('code'):
+			raise ServerError('Server failure: '
+					+ repr(jsonout['error'].get('code')) + ': '
+					+ repr(jsonout['error'].get('message')))
+		if isinstance(jsonout.get('result'), list):
+			try:
+				for jele in jsonout['result']:
+					parse_ele()
+			except (KeyError, TypeError, AttributeError, ValueError) as e:
+				raise ParseError('Malformed JSON result: {}: {}'.format(
+					type(e).__name__, e))
+	return result
+
+def filter_check(filters):
+	'''Return the filters usable on this system.'''
+	usable = list()
+	for filter_name in filters:
+		if 'gentoo' != system:
+			report(LOGLEVELS.warning, 'filter {} is not available for non-Gentoo'
+					' systems. Filter ignored.'.format(filter_name))
+		elif filter_name not in usable:
+			usable.append(filter_name)
+	return usable
+
+def filter_cp(cp_group, filters):
+	'''Return whether cp_group passes the cp-level filters.'''
+	if 'available' in filters and not cp_group['ver_available']:
+		return False
+	if 'installed' in filters and not cp_group['installed_flag']:
+		return False
+	# TODO: Implement more filters here
+	return True
+
+def filter_result(result, filters):
+	filters = filter_check(filters)
+	rmlst_cp = [ cp for cp, cp_group in result.items()
+			if not filter_cp(cp_group, filters) ]
+	for cp in rmlst_cp:
+		del result[cp]
+	return result
+
+def sort_result(result):
+	for cp, cp_group in result.items():
+		for ver, ver_group in cp_group['ver_groups'].items():
+			ver_group['path_groups'] = \
+					sorted(ver_group['path_groups'].items(),
+					key = sort_key_path_group)
+		cp_group['ver_groups'] = \
+				sorted(cp_group['ver_groups'].items(),
+				key = sort_key_ver_group)
+	result = sorted(result.items(),
+			key = sort_key_cp_group)
+	return result
+
+def output_preprocess(cp, cp_group, fmtstr):
+	def str_hl(string, dec_id):
+		return (fmtstr['prefix_' + dec_id] + string +
+				fmtstr['suffix_' + dec_id])
+	
+	def lst_to_str(lst, sep, match, dec_id):
+		newlst = [ (str_hl(item, dec_id) if item in match else item)
+				for item in lst ]
+		return sep.join(newlst)
+
+	def lst_to_str_double(lst, sep, match, dec_id, match2, dec_id2):
+		newlst = [ (str_hl(item, dec_id) if item in match else 
+				(str_hl(item, dec_id2) if item in match2 else item))
+				for item in lst ]
+		return sep.join(newlst)
+
+	def repr_bool(val, dec_id):
+		if val:
+			return fmtstr['repr_true_' + dec_id]
+		else:
+			return fmtstr['repr_false_' + dec_id]
+
+	def repr_empty_str(val, dec_id):
+		if val:
+			return val
+		else:
+			return fmtstr['repr_empty_' + dec_id]
+	
+	def ver_hl(string, ver, cp_group, ver_group):
+		if ver:
+			if 'installed' == ver_group['installed_flag']:
+				string = str_hl(string, 'installed')
+			elif ver in cp_group['ver_available']:
+				string = str_hl(string, 'available')
+		else:
+			string = repr_empty_str(string, 'ver')
+		return string
+
+	cp_group['path_all'] = set()
+	cp_group['path_all_exists'] = set()
+	cp_group['ver_all'] = set()
+	for ver, ver_group in cp_group['ver_groups']:
+		ver_group['path_all'] = set()
+		ver_group['path_all_exists'] = set()
+		for path, path_group in ver_group['path_groups']:
+			path_group['type_str'] = \
+					fmtstr['sep'].join(path_group.get('type', ''))
+			path_group['arch_str'] = \
+					fmtstr['sep'].join(path_group.get('arch', ''))
+			path_group['use_str'] = \
+					fmtstr['sep'].join(path_group.get('use', ''))
+			ver_group['path_all'].add(path)
+			path_group['exists_str'] = repr_bool(path_group['exists'],
+					'exists')
+			if path_group['exists']:
+				path_group['path_hl'] = str_hl(path, 'exists')
+				ver_group['path_all_exists'].add(path)
+			else:
+				path_group['path_hl'] = path
+		ver_group['ver_hl'] = ver_hl(ver, ver, cp_group, ver_group)
+		ver_group['cpv_hl'] = ver_hl(ver_group['cpv'], ver, cp_group, 
+				ver_group)
+		ver_group['exists_str'] = repr_bool(ver_group['exists'], 'exists')
+		ver_group['symbol'] = fmtstr \
+				['sym_' + ver_group['installed_flag']]
+		ver_group['path_all_str'] = \
+				fmtstr['sep'].join(ver_group['path_all'])
+		ver_group['path_all_str_hl'] = lst_to_str(ver_group['path_all'],
+			fmtstr['sep'], ver_group['path_all_exists'], 'exists')
+		cp_group['path_all'] |= ver_group['path_all']
+		cp_group['path_all_exists'] |= ver_group['path_all_exists']
+		cp_group['ver_all'].add(ver)
+		ver_group['path_all'] = sorted(ver_group['path_all'])
+		ver_group['path_all_exists'] = sorted(ver_group['path_all_exists'])
+	cp_group['path_all'] = sorted(cp_group['path_all'])
+	cp_group['path_all_exists'] = sorted(cp_group['path_all_exists'])
+	cp_group['ver_all'] = sorted(cp_group['ver_all'], key = sort_key_ver)
+	cp_group['exists_str'] = repr_bool(cp_group['exists'], 'exists')
+	cp_group['path_all_str'] = \
+				fmtstr['sep'].join(cp_group['path_all'])
+	cp_group['path_all_str_hl'] = lst_to_str(cp_group['path_all'],
+			fmtstr['sep'], cp_group['path_all_exists'], 'exists')
+	cp_group['ver_all_str'] = repr_empty_str(
+			fmtstr['sep'].join(cp_group['ver_all']), 'ver_all')
+	cp_group['ver_all_str_hl'] = repr_empty_str(lst_to_str_double(
+			cp_group['ver_all'], fmtstr['sep'], cp_group['ver_installed'],
+			'installed', cp_group['ver_available'], 'available'), 'ver_all')
+	cp_group['ver_available_str'] = \
+			fmtstr['sep'].join(cp_group['ver_available'])
+	cp_group['ver_available_str_hl'] = repr_empty_str(lst_to_str_double(
+			cp_group['ver_available'], fmtstr['sep'],
+			cp_group['ver_installed'], 'installed',
+			cp_group['ver_all'], 'matched'), 'ver_available')
+	cp_group['ver_installed_str'] = \
+			fmtstr['sep'].join(cp_group['ver_installed'])
+	cp_group['ver_installed_str_hl'] = repr_empty_str(fmtstr['sep'].join(
+			[ str_hl(ver, 'installed') for ver
+			in cp_group['ver_installed'] ]), 'ver_installed')
+	cp_group['symbol'] = fmtstr['sym_' + cp_group['installed_flag']]
+
+def structured_records(mode, cp, cp_group, output):
+	'''Yield the JSON-serializable records of a cp_group. The json output
+	gives one nested record per cp, ndjson one flat record per path, or
+	per version in cptov mode.'''
+	cp_rec = dict(cp = cp)
+	cp_rec.update((key, value) for key, value in cp_group.items()
+			if 'ver_groups' != key)
+	ver_recs = list()
+	for ver, ver_group in sorted(cp_group['ver_groups'].items(),
+			key = sort_key_ver_group):
+		ver_rec = dict(ver = ver)
+		ver_rec.update((key, value) for key, value in ver_group.items()
+				if 'path_groups' != key)
+		if not ver:
+			ver_rec['cpv'] = None
+		path_recs = list()
+		if 'cptov' != mode:
+			for path, path_group in sorted(ver_group['path_groups'].items(),
+					key = sort_key_path_group):
+				path_rec = dict(path = path)
+				path_rec.update(path_group)
+				path_recs.append(path_rec)
+		if 'json' == output:
+			ver_rec['paths'] = path_recs
+			ver_recs.append(ver_rec)
+			continue
+		rec = dict(cp = cp, c = cp_group['c'], p = cp_group['p'],
+				ver = ver, cpv = ver_rec['cpv'],
+				installed_flag = ver_rec.get('installed_flag'))
+		if not path_recs:
+			rec['exists'] = ver_rec.get('exists')
+			yield rec
+		for path_rec in path_recs:
+			rec_path = dict(rec)
+			rec_path.update(path_rec)
+			yield rec_path
+	if 'json' == output:
+		cp_rec['versions'] = ver_recs
+		yield cp_rec
+
+def print_result(mode, query, result, fmtstr):
+	def ifsearch(key, kwargs):
+		pos = key.find('_if_not_')
+		if -1 != pos:
+			return not bool(kwargs[key[pos + len('_if_not_'):]])
+		pos = key.find('_if_')
+		if -1 != pos:
+			return bool(kwargs[key[pos + len('_if_'):]])
+		return True
+
+	cp_count = len(result)
+	if not cp_count:
+		print(fmtstr['noresult'], end = '')
+		return 1
+	lvpath_subs = [ key for key in fmtstr if key.startswith('lvpath_sub_') ]
+	lvver_subs = [ key for key in fmtstr if key.startswith('lvver_sub_') ]
+	lvcp_subs = [ key for key in fmtstr if key.startswith('lvcp_sub_') ]
+	strdct_lvver = { key: '' for key in lvver_subs }
+	strdct_lvver['lvver'] = ''
+	strdct_lvpath = { key: '' for key in lvpath_subs }
+	strdct_lvpath['lvpath'] = ''
+	for cp, cp_group in result:
+		cp_kwargs = query.copy()
+		cp_kwargs.update(cp_group)
+		del cp_kwargs['ver_groups']
+		cp_kwargs['cp'] = cp
+		for key in strdct_lvver:
+			strdct_lvver[key] = ''
+		ver_count = len(cp_group['ver_groups'])
+		for ver, ver_group in cp_group['ver_groups']:
+			ver_kwargs = { 'lvver_' + key: value for key, value
+					in ver_group.items() if 'path_groups' != key }
+			ver_kwargs.update(cp_kwargs)
+			ver_kwargs['ver'] = ver
+			for key in strdct_lvpath:
+				strdct_lvpath[key] = ''
+			path_count = len(ver_group['path_groups'])
+			for path, path_group in ver_group['path_groups']:
+				path_kwargs = { 'lvpath_' + key: value for key, value
+						in path_group.items() if 'path_groups' != key }
+				path_kwargs.update(ver_kwargs)
+				path_kwargs['path'] = path
+				strdct_cur = dict()
+				for key in lvpath_subs:
+					if ifsearch(key, path_kwargs):
+						strdct_cur[key] = fmtstr[key].format(**path_kwargs)
+					else:
+						strdct_cur[key] = ''
+					path_kwargs[key] = strdct_cur[key]
+					strdct_lvpath[key] += strdct_cur[key]
+				strdct_lvpath['lvpath'] += \
+						fmtstr['lvpath'].format(**path_kwargs)
+				path_count -= 1
+				if path_count:
+					for key in strdct_lvpath:
+						strdct_lvpath[key] += fmtstr.get('sep_' + key, '')
+			ver_kwargs.update(strdct_lvpath)
+			strdct_cur = dict()
+			for key in lvver_subs:
+				if ifsearch(key, ver_kwargs):
+					strdct_cur[key] = fmtstr[key].format(**ver_kwargs)
+				else:
+					strdct_cur[key] = ''
+				ver_kwargs[key] = strdct_cur[key]
+				strdct_lvver[key] += strdct_cur[key]
+			strdct_lvver['lvver'] += \
+					fmtstr['lvver'].format(**ver_kwargs)
+			ver_count -= 1
+			if ver_count:
+				for key in strdct_lvver:
+					strdct_lvver[key] += fmtstr.get('sep_' + key, '')
+		cp_kwargs.update(strdct_lvver)
+		for key in lvcp_subs:
+			if ifsearch(key, cp_kwargs):
+				cp_kwargs[key] = fmtstr[key].format(**cp_kwargs)
+			else:
+				cp_kwargs[key] = ''
+		lvcp_str = fmtstr['lvcp'].format(**cp_kwargs)
+		cp_count -= 1
+		if cp_count:
+			lvcp_str += fmtstr['sep_lvcp']
+		print(lvcp_str, end = '')
+	return 0
+
+def contents_read(path):
+	'''Return the set of files and symlinks listed in a CONTENTS file.'''
+	paths = set()
+	with open(path, 'r', encoding = 'utf-8', errors = 'replace') as f:
+		for line in f:
+			entry_type, _, rest = line.rstrip('\n').partition(' ')
+			if 'obj' == entry_type:
+				# obj <path> <md5> <mtime>
+				paths.add(rest.rsplit(' ', 2)[0])
+			elif 'sym' == entry_type:
+				# sym <path> -> <target> <mtime>
+				paths.add(rest.split(' -> ', 1)[0])
+	return paths
+
+def is_lookup_target(path):
+	'''Return whether path is a library or executable whose name is
+	likely to be looked up.'''
+	dirname, name = os.path.split(path)
+	return os.path.basename(dirname) in ('bin', 'sbin') \
+			or (name.startswith('lib') and '.so' in name)
+
+class DirScanner:
+	'''Answer existence checks from one listing per directory, which is
+	much cheaper than a stat per path when many paths share directories.
+	Like os.path.lexists(), dangling symlinks count as existing.'''
+
+	def __init__(self):
+		self.listings = dict()
+
+	def exists(self, path):
+		dirname, name = os.path.split(path)
+		listing = self.listings.get(dirname)
+		if listing is None:
+			try:
+				listing = frozenset(os.listdir(dirname))
+			except OSError:
+				listing = frozenset()
+			self.listings[dirname] = listing
+		return name in listing
+
+def diff_tables(rec_base, old, new):
+	'''Yield a record based on rec_base per path added, removed or
+	changed between the Session.file_table() tables old and new.'''
+	for path in sorted(old.keys() | new.keys()):
+		if path not in old:
+			yield dict(rec_base, status = 'added', path = path,
+					arch = list(new[path][0]), use = list(new[path][1]))
+		elif path not in new:
+			yield dict(rec_base, status = 'removed', path = path,
+					arch = list(old[path][0]), use = list(old[path][1]))
+		elif old[path] != new[path]:
+			yield dict(rec_base, status = 'changed', path = path,
+					arch_from = list(old[path][0]),
+					arch_to = list(new[path][0]),
+					use_from = list(old[path][1]),
+					use_to = list(new[path][1]))
+
+# ELF
+
+# Keywords of PFL for ELF e_machine values
+ELF_MACHINE_ARCH = {
+		2: 'sparc', 3: 'x86', 8: 'mips', 15: 'hppa', 20: 'ppc', 21: 'ppc64',
+		22: 's390', 40: 'arm', 43: 'sparc', 50: 'ia64', 62: 'amd64',
+		183: 'arm64', 243: 'riscv', 258: 'loong', 0x9026: 'alpha',
+}
+
+# Directories searched by ld.so after ld.so.conf
+ELF_DEFAULT_LIBDIRS = ('/lib64', '/usr/lib64', '/lib', '/usr/lib')
+
+def elf_read(path):
+	'''Return dict(elf_class, machine, needed, rpath, runpath) of the ELF
+	file path, from its dynamic section. elf_class is 32 or 64, rpath
+	and runpath are lists of directories as written in the file.'''
+	try:
+		f = open(path, 'rb')
+	except OSError as e:
+		raise QueryError('Failed to open {}: {}'.format(path, e.strerror))
+	with f:
+		ident = f.read(16)
+		if len(ident) < 16 or b'\x7fELF' != ident[:4] \
+				or ident[4] not in (1, 2) or ident[5] not in (1, 2):
+			raise QueryError(path + ' is not an ELF file.')
+		end = '<' if 1 == ident[5] else '>'
+		if 1 == ident[4]:
+			ehdr, phdr, dyn = 'HHIIIIIHHHHHH', 'IIIIIIII', 'iI'
+		else:
+			ehdr, phdr, dyn = 'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'
+		try:
+			m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		except (OSError, ValueError) as e:
+			raise QueryError('Failed to read {}: {}'.format(path, e))
+	with m:
+		try:
+			(e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+					e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum,
+					e_shstrndx) = struct.unpack_from(end + ehdr, m, 16)
+			loads = list()
+			dynamic = None
+			for i in range(e_phnum):
+				fields = struct.unpack_from(end + phdr, m,
+						e_phoff + i * e_phentsize)
+				if 1 == ident[4]:
+					p_type, p_offset, p_vaddr, p_paddr, p_filesz = fields[:5]
+				else:
+					p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz \
+							= fields[:6]
+				if 1 == p_type:
+					# PT_LOAD
+					loads.append((p_vaddr, p_offset, p_filesz))
+				elif 2 == p_type:
+					# PT_DYNAMIC
+					dynamic = (p_offset, p_filesz)
+			info = dict(elf_class = 32 if 1 == ident[4] else 64,
+					machine = e_machine, needed = list(), rpath = list(),
+					runpath = list())
+			if not dynamic:
+				return info
+			entries = list()
+			strtab = None
+			size = struct.calcsize(end + dyn)
+			for off in range(dynamic[0], dynamic[0] + dynamic[1], size):
+				tag, val = struct.unpack_from(end + dyn, m, off)
+				if 0 == tag:
+					# DT_NULL
+					break
+				if 5 == tag:
+					# DT_STRTAB, an address
+					strtab = val
+				elif tag in (1, 15, 29):
+					# DT_NEEDED, DT_RPATH, DT_RUNPATH, offsets into strtab
+					entries.append((tag, val))
+			if strtab is None:
+				return info
+			for vaddr, offset, filesz in loads:
+				if vaddr <= strtab < vaddr + filesz:
+					strtab = strtab - vaddr + offset
+					break
+			else:
+				raise QueryError('Invalid string table in {}.'.format(path))
+			for tag, val in entries:
+				start = strtab + val
+				string = m[start:m.find(b'\0', start)].decode('utf-8',
+						'replace')
+				if 1 == tag:
+					info['needed'].append(string)
+				else:
+					info['runpath' if 29 == tag else 'rpath'].extend(
+							item for item in string.split(':') if item)
+			return info
+		except struct.error:
+			raise QueryError(path + ' is a truncated ELF file.')
+
+def ld_so_conf_dirs(path = '/etc/ld.so.conf', seen = None):
+	'''Return the directories listed in ld.so.conf, following includes.'''
+	seen = set() if seen is None else seen
+	if path in seen:
+		return list()
+	seen.add(path)
+	dirs = list()
+	try:
+		with open(path, 'r') as f:
+			lines = f.readlines()
+	except OSError:
+		return dirs
+	for line in lines:
+		line = line.partition('#')[0].strip()
+		if line.startswith('include') and line[7:8].isspace():
+			for pattern in line[8:].split():
+				pattern = os.path.join(os.path.dirname(path), pattern)
+				for inc in sorted(glob.glob(pattern)):
+					dirs.extend(ld_so_conf_dirs(inc, seen))
+		elif line:
+			dirs.append(line)
+	return dirs
+
+def elf_missing(paths):
+	'''Return an OrderedDict of the libraries needed by the ELF files
+	paths, or by the libraries they load, that are not found the way
+	ld.so looks for them, mapped to dict(needed_by, elf_class, machine)
+	of the files needing them.'''
+	system_dirs = ([ item for item in os.environ.get('LD_LIBRARY_PATH',
+		'').split(':') if item ], ld_so_conf_dirs()
+		+ list(ELF_DEFAULT_LIBDIRS))
+	scanner = DirScanner()
+	headers = dict()
+	missing = collections.OrderedDict()
+
+	def compatible(path, info):
+		# Like ld.so, skip libraries of another class or machine
+		if path not in headers:
+			try:
+				with open(path, 'rb') as f:
+					ident = f.read(20)
+				end = '<' if 1 == ident[5] else '>'
+				headers[path] = (32 if 1 == ident[4] else 64,
+						struct.unpack_from(end + 'H', ident, 18)[0])
+			except (OSError, IndexError, struct.error):
+				headers[path] = None
+		return (info['elf_class'], info['machine']) == headers[path]
+
+	def find(name, path, info):
+		if '/' in name:
+			return name if os.path.exists(name) else None
+		origin = os.path.dirname(os.path.realpath(path))
+		dirs = list()
+		if not info['runpath']:
+			dirs.extend(info['rpath'])
+		dirs.extend(system_dirs[0])
+		dirs.extend(info['runpath'])
+		dirs.extend(system_dirs[1])
+		for libdir in dirs:
+			libdir = libdir.replace('${ORIGIN}', origin) \
+					.replace('$ORIGIN', origin).replace('${LIB}', 'lib'
+					+ ('64' if 64 == info['elf_class'] else '')) \
+					.replace('$LIB', 'lib'
+					+ ('64' if 64 == info['elf_class'] else ''))
+			lib = os.path.join(libdir, name)
+			if scanner.exists(lib) and compatible(lib, info):
+				return lib
+		return None
+
+	queue = [ (path, None) for path in paths ]
+	seen = set()
+	while queue:
+		path, info = queue.pop(0)
+		real = os.path.realpath(path)
+		if real in seen:
+			continue
+		seen.add(real)
+		try:
+			info = elf_read(path)
+		except QueryError as e:
+			if info is None:
+				# Given on the command line
+				raise
+			report(LOGLEVELS.warning, str(e))
+			continue
+		for name in info['needed']:
+			lib = find(name, path, info)
+			if lib:
+				queue.append((lib, info))
+			elif name in missing:
+				if path not in missing[name]['needed_by']:
+					missing[name]['needed_by'].append(path)
+			else:
+				missing[name] = dict(needed_by = [ path ],
+						elf_class = info['elf_class'],
+						machine = info['machine'])
+	return missing
+
+def lib_candidates(result, elf_class, machine):
+	'''Return the packages of the uniq query result providing a library,
+	most likely first: those installing it into a library directory
+	matching elf_class, for the architecture of machine.'''
+	arch = ELF_MACHINE_ARCH.get(machine)
+	libdir = re.compile(r'^(/usr)?/lib{}/[^/]+$'.format('64'
+		if 64 == elf_class else '(32)?'))
+	scores = dict()
+	for cp, cp_group in result.items():
+		score = 0
+		for ver, ver_group in cp_group['ver_groups'].items():
+			for path, path_group in ver_group['path_groups'].items():
+				score = max(score, (2 if libdir.match(path) else 0)
+						+ (1 if arch in path_group.get('arch', ()) else 0))
+		scores[cp] = score
+	return sorted(scores, key = lambda cp: (-scores[cp], cp))
+
+# Metrics
+#
+# Labelled counters and histograms live in Session.stats next to the plain
+# counters, under keys in the sample syntax of the Prometheus text format,
+# e.g. 'queries{mode="uniq",source="pfl_json"}', so that they are saved
+# and summed across runs with the rest. Histogram buckets are stored
+# non-cumulative and added up on export.
+
+# Upper bounds (seconds) of the latency histogram buckets
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+		1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_HISTOGRAMS = ('stage_seconds', )
+
+@functools.lru_cache(maxsize = 1024)
+def metric_key(name, **labels):
+	'''Return the Session.stats key of counter name with labels.'''
+	if not labels:
+		return name
+	return name + '{' + ','.join('{}="{}"'.format(key, labels[key])
+			for key in sorted(labels)) + '}'
+
+def metrics_snapshot(counters):
+	'''Return counters (Session.stats or saved totals) as
+	dict(counters = { name: [ dict(labels, value) ] },
+	histograms = { name: [ dict(labels, buckets, sum, count) ] }),
+	with cumulative buckets keyed by their upper bound, in ascending
+	order, and names in sorted order.'''
+	snapshot = dict(counters = dict(), histograms = dict())
+	hists = dict()
+	for key in sorted(counters):
+		name, _, labels = key.partition('{')
+		labels = dict(re.findall(r'(\w+)="([^"]*)"', labels))
+		base, _, part = name.rpartition('_')
+		# Also those of --warm, moved to warm_ names
+		if base in METRIC_HISTOGRAMS or base.startswith('warm_') \
+				and base[5:] in METRIC_HISTOGRAMS:
+			le = labels.pop('le', None)
+			ident = (base, tuple(sorted(labels.items())))
+			if ident not in hists:
+				hists[ident] = dict(labels = labels, buckets = dict(),
+						sum = 0, count = 0)
+				snapshot['histograms'].setdefault(base, list()).append(
+						hists[ident])
+			if 'bucket' == part:
+				hists[ident]['buckets'][le] = counters[key]
+			else:
+				hists[ident][part] = counters[key]
+		else:
+			snapshot['counters'].setdefault(name, list()).append(
+					dict(labels = labels, value = counters[key]))
+	for hist in hists.values():
+		total = 0
+		buckets = dict()
+		for le in METRIC_BUCKETS + ('+Inf', ):
+			total += hist['buckets'].get(str(le), 0)
+			buckets[str(le)] = total
+		hist['buckets'] = buckets
+	return snapshot
+
+def metrics_text(counters, prefix = 'efilepy_'):
+	'''Return counters (Session.stats or saved totals) in the Prometheus
+	text format.'''
+	def fmt_labels(labels):
+		if not labels:
+			return ''
+		return '{' + ','.join('{}="{}"'.format(key, value)
+				for key, value in labels.items()) + '}'
+
+	snapshot = metrics_snapshot(counters)
+	lines = list()
+	for name, samples in sorted(snapshot['counters'].items()):
+		lines.append('# TYPE {}{}_total counter'.format(prefix, name))
+		for sample in samples:
+			lines.append('{}{}_total{} {}'.format(prefix, name,
+				fmt_labels(sample['labels']), sample['value']))
+	for name, hists in sorted(snapshot['histograms'].items()):
+		lines.append('# TYPE {}{} histogram'.format(prefix, name))
+		for hist in hists:
+			for le, value in hist['buckets'].items():
+				lines.append('{}{}_bucket{} {}'.format(prefix, name,
+					fmt_labels(dict(hist['labels'], le = le)), value))
+			for part in ('sum', 'count'):
+				lines.append('{}{}_{}{} {}'.format(prefix, name, part,
+					fmt_labels(hist['labels']), hist[part]))
+	return ''.join(line + '\n' for line in lines)
+
+def build_fmtstr(name, overrides = ()):
+	'''Return the format string set name, with KEY:VALUE overrides
+	applied and missing items filled from the base set.'''
+	if name not in PREDEF_FMTSTR:
+		raise QueryError('Unknown format string set: ' + name)
+	fmtstr = dict(PREDEF_FMTSTR[name])
+	for item in overrides:
+		key, value = item.split(':', 1)
+		fmtstr[key] = value
+	for key, value in PREDEF_FMTSTR['base'].items():
+		if key not in fmtstr:
+			fmtstr[key] = value
+	return fmtstr
+
+# Session
+
+class Session:
+	'''Configuration, Portage handles, connections and caches shared by
+	a series of queries. Keyword arguments override DEFAULT_CONF.
+	Errors are raised as subclasses of Error.'''
+
+	def __init__(self, **kwargs):
+		unknown = set(kwargs) - set(DEFAULT_CONF)
+		if unknown:
+			raise TypeError('Unknown configuration: '
+					+ ', '.join(sorted(unknown)))
+		self.conf = copy.deepcopy(DEFAULT_CONF)
+		self.conf.update(kwargs)
+		self.system = system
+		if 'gentoo' == self.system:
+			self.db_port = portage.portdb
+			self.db_installed = portage.db[portage.root]['vartree'].dbapi
+		self._lock = threading.Lock()
+		self._pool = dict()
+		self._mem_cache = collections.OrderedDict()
+		self._cp_cache = dict()
+		self._parse_pool = None
+		self._metrics_server = None
+		# Circuit breaker state, loaded once, and the start times of the
+		# probes let through half-open breakers
+		self._breaker = None
+		self._breaker_probes = dict()
+		# Counters of requests, bytes and cache use since creation
+		self.stats = collections.Counter()
+		self._stats_saved = collections.Counter()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		'''Close idle connections, stop the parser processes and the
+		metrics server, and save the statistics and metrics.'''
+		self.stats_save()
+		if self.conf['metrics_file']:
+			self.metrics_write(self.conf['metrics_file'])
+		if self._metrics_server:
+			self._metrics_server.shutdown()
+			self._metrics_server.server_close()
+			self._metrics_server = None
+		if self._parse_pool:
+			self._parse_pool.shutdown()
+			self._parse_pool = None
+		with self._lock:
+			pool, self._pool = self._pool, dict()
+		for conns in pool.values():
+			for conn in conns:
+				conn.close()
+
+	def count(self, key, n = 1):
+		with self._lock:
+			self.stats[key] += n
+
+	def observe(self, name, value, **labels):
+		'''Add value to the histogram name.'''
+		i = bisect.bisect_left(METRIC_BUCKETS, value)
+		le = METRIC_BUCKETS[i] if i < len(METRIC_BUCKETS) else '+Inf'
+		with self._lock:
+			self.stats[metric_key(name + '_bucket', le = le, **labels)] += 1
+			self.stats[metric_key(name + '_sum', **labels)] += value
+			self.stats[metric_key(name + '_count', **labels)] += 1
+
+	@contextlib.contextmanager
+	def timed(self, stage):
+		'''Record the time spent in the with block in the stage_seconds
+		histogram.'''
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe('stage_seconds', time.perf_counter() - start,
+					stage = stage)
+
+	def metrics_totals(self):
+		'''Return the saved totals with the counters not saved yet.
+		Without the cache nothing is saved, and the totals are the
+		counters of this session.'''
+		with self._lock:
+			if not self.conf['cache']:
+				return collections.Counter(self.stats)
+			delta = self.stats - self._stats_saved
+		return collections.Counter(self.stats_load()['counters']) + delta
+
+	def metrics_write(self, path):
+		'''Write metrics_totals() in the Prometheus text format to path,
+		atomically, or to stdout if path is '-'.'''
+		text = metrics_text(self.metrics_totals())
+		if '-' == path:
+			sys.stdout.write(text)
+			return
+		try:
+			with open(path + '.tmp', 'w') as f:
+				f.write(text)
+			os.replace(path + '.tmp', path)
+		except OSError as e:
+			report(LOGLEVELS.warning, 'Failed to write metrics: ' + str(e))
+
+	def metrics_serve(self, port, address = '127.0.0.1'):
+		'''Serve metrics_totals() on http://address:port/metrics in the
+		Prometheus text format, and /metrics.json as metrics_snapshot(),
+		from a background thread until close().'''
+		import http.server
+		session = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				if '/metrics' == self.path:
+					body = metrics_text(session.metrics_totals())
+					ctype = 'text/plain; version=0.0.4'
+				elif '/metrics.json' == self.path:
+					body = json.dumps(metrics_snapshot(
+						session.metrics_totals()))
+					ctype = 'application/json'
+				else:
+					self.send_error(404)
+					return
+				body = body.encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', ctype)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		try:
+			server = http.server.ThreadingHTTPServer((address, port), Handler)
+		except OSError as e:
+			raise Error('Failed to serve metrics on {}:{}: {}'.format(address,
+				port, e))
+		server.daemon_threads = True
+		threading.Thread(target = server.serve_forever, daemon = True).start()
+		self._metrics_server = server
+		return server
+
+	def stats_save(self):
+		'''Add the counters gathered since the last call to the totals
+		kept in the cache directory.'''
+		with self._lock:
+			delta = self.stats - self._stats_saved
+			self._stats_saved = collections.Counter(self.stats)
+		if not self.conf['cache'] or not delta:
+			return
+		totals = self.stats_load()
+		totals['counters'] = dict(collections.Counter(totals['counters'])
+				+ delta)
+		if delta['warm_runs']:
+			totals['last_warm'] = time.time()
+		try:
+			os.makedirs(self.conf['cache_dir'], exist_ok = True)
+			path = os.path.join(self.conf['cache_dir'], 'stats.json')
+			with open(path + '.tmp', 'w') as f:
+				json.dump(totals, f)
+			os.replace(path + '.tmp', path)
+		except OSError as e:
+			report(LOGLEVELS.debug, 'Failed to save statistics: ' + str(e))
+
+	def stats_load(self):
+		'''Return the totals saved by stats_save().'''
+		try:
+			with open(os.path.join(self.conf['cache_dir'], 'stats.json'),
+					'r') as f:
+				totals = json.load(f)
+			if isinstance(totals, dict):
+				totals.setdefault('counters', dict())
+				return totals
+		except (OSError, ValueError):
+			pass
+		return dict(counters = dict())
+
+	def history_add(self, mode, args):
+		'''Record a lookup for the cache warmer. The history file is cut
+		back to history_size entries once it holds twice as many.'''
+		size = self.conf['history_size']
+		if not (self.conf['cache'] and size):
+			return
+		path = os.path.join(self.conf['cache_dir'], 'history')
+		try:
+			os.makedirs(self.conf['cache_dir'], exist_ok = True)
+			with open(path, 'a') as f:
+				f.write(json.dumps([ mode, list(args) ]) + '\n')
+				# No entry is shorter than 16 bytes, so smaller files need
+				# no counting
+				if f.tell() <= 2 * size * 16:
+					return
+			with open(path, 'r') as f:
+				lines = f.readlines()
+		except OSError as e:
+			report(LOGLEVELS.debug, 'Failed to write history: ' + str(e))
+			return
+		if len(lines) > 2 * size:
+			self.history_trim(path, lines[-size:])
+
+	def history_trim(self, path, lines):
+		try:
+			with open(path + '.tmp', 'w') as f:
+				f.writelines(lines)
+			os.replace(path + '.tmp', path)
+		except OSError as e:
+			report(LOGLEVELS.debug, 'Failed to write history: ' + str(e))
+
+	def history_read(self):
+		'''Return the last history_size (mode, args) recorded by
+		history_add(), truncating the history file to them.'''
+		path = os.path.join(self.conf['cache_dir'], 'history')
+		try:
+			with open(path, 'r') as f:
+				lines = f.readlines()
+		except OSError:
+			return list()
+		if len(lines) > self.conf['history_size']:
+			lines = lines[-self.conf['history_size']:]
+			self.history_trim(path, lines)
+		entries = list()
+		for line in lines:
+			try:
+				mode, args = json.loads(line)
+			except ValueError:
+				continue
+			entries.append((mode, args))
+		return entries
+
+	def dbg_write(self, id, content):
+		'''Write some contents to a temporary file for debugging.'''
+		if not self.conf['debug']:
+			return
+		with open('/tmp/' + id, 'w') as f:
+			f.write(content)
+
+	# Response cache
+
+	def cache_path(self, key, suffix):
+		return os.path.join(self.conf['cache_dir'], key[:2], key + suffix)
+
+	def cache_load(self, key):
+		'''Return (meta, str_raw) of a cache entry, or (None, None).'''
+		if not self.conf['cache']:
+			return None, None
+		with self._lock:
+			if key in self._mem_cache:
+				self._mem_cache.move_to_end(key)
+				return self._mem_cache[key]
+		try:
+			with open(self.cache_path(key, '.json'), 'r') as f:
+				meta = json.load(f)
+			with gzip.open(self.cache_path(key, '.gz'), 'rb') as f:
+				str_raw = f.read().decode('utf-8')
+		except (OSError, ValueError, EOFError):
+			return None, None
+		self.mem_cache_store(key, meta, str_raw)
+		return meta, str_raw
+
+	def mem_cache_store(self, key, meta, str_raw):
+		with self._lock:
+			self._mem_cache[key] = (meta, str_raw)
+			self._mem_cache.move_to_end(key)
+			while len(self._mem_cache) > self.conf['mem_cache_size']:
+				self._mem_cache.popitem(last = False)
+
+	def cache_fresh(self, key):
+		'''Return whether key has a cache entry younger than cache_ttl,
+		without loading the body.'''
+		if not self.conf['cache']:
+			return False
+		with self._lock:
+			meta = self._mem_cache.get(key, (None, None))[0]
+		if meta is None:
+			try:
+				with open(self.cache_path(key, '.json'), 'r') as f:
+					meta = json.load(f)
+			except (OSError, ValueError):
+				return False
+		return time.time() - meta['time'] < self.conf['cache_ttl']
+
+	def cache_store(self, key, meta, str_raw = None):
+		'''Write a cache entry. With str_raw being None only the metadata
+		is updated.'''
+		if not self.conf['cache']:
+			return
+		if str_raw is not None:
+			self.mem_cache_store(key, meta, str_raw)
+		try:
+			os.makedirs(os.path.dirname(self.cache_path(key, '')),
+					exist_ok = True)
+			if str_raw is not None:
+				with gzip.open(self.cache_path(key, '.gz.tmp'), 'wb') as f:
+					f.write(str_raw.encode('utf-8'))
+				os.replace(self.cache_path(key, '.gz.tmp'),
+						self.cache_path(key, '.gz'))
+			with open(self.cache_path(key, '.json.tmp'), 'w') as f:
+				json.dump(meta, f)
+			os.replace(self.cache_path(key, '.json.tmp'),
+					self.cache_path(key, '.json'))
+		except OSError as e:
+			report(LOGLEVELS.warning, 'Failed to write cache: ' + str(e))
+
+	# Circuit breaker
+	# The state is kept in the cache directory, so that it survives across
+	# invocations: a server that failed the last few runs is not waited
+	# for again until the cooldown expires.
+
+	def breaker_load(self):
+		try:
+			with open(os.path.join(self.conf['cache_dir'], 'breaker.json'),
+					'r') as f:
+				state = json.load(f)
+			if isinstance(state, dict):
+				return state
+		except (OSError, ValueError):
+			pass
+		return dict()
+
+	def breaker_save(self, state):
+		try:
+			os.makedirs(self.conf['cache_dir'], exist_ok = True)
+			path = os.path.join(self.conf['cache_dir'], 'breaker.json')
+			tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+			with open(tmp_path, 'w') as f:
+				json.dump(state, f)
+			os.replace(tmp_path, path)
+		except OSError as e:
+			report(LOGLEVELS.debug, 'Failed to save breaker state: ' + str(e))
+
+	def breaker_state(self):
+		'''Return the breaker state, read from the cache directory on first
+		use. Called with self._lock held.'''
+		if self._breaker is None:
+			self._breaker = self.breaker_load()
+		return self._breaker
+
+	def breaker_allow(self, host):
+		'''Return whether a request to host may be sent. Once the cooldown
+		of an open breaker has expired, it lets a single probe through and
+		fails the other requests fast until the result of the probe is
+		recorded, or the probe outlived the deadline of a query.'''
+		if not self.conf['breaker_threshold']:
+			return True
+		with self._lock:
+			host_state = self.breaker_state().get(host, dict())
+			if host_state.get('failures', 0) < self.conf['breaker_threshold']:
+				return True
+			now = time.time()
+			if now - host_state.get('opened', 0) < self.conf['breaker_cooldown'] \
+					or now - self._breaker_probes.get(host, 0) \
+					< self.conf['deadline']:
+				return False
+			self._breaker_probes[host] = now
+			return True
+
+	def breaker_record(self, host, success):
+		'''Record the outcome of a query to host, once per query rather than
+		per attempt.'''
+		if not self.conf['breaker_threshold']:
+			return
+		with self._lock:
+			self._breaker_probes.pop(host, None)
+			state = self.breaker_state()
+			host_state = state.get(host, dict(failures = 0, opened = 0))
+			if success:
+				if not host_state.get('failures'):
+					return
+				host_state = dict(failures = 0, opened = 0)
+			else:
+				host_state['failures'] = host_state.get('failures', 0) + 1
+				if host_state['failures'] >= self.conf['breaker_threshold']:
+					host_state['opened'] = time.time()
+					report(LOGLEVELS.debug, 'Circuit breaker opened for ' + host)
+			state[host] = host_state
+			self.breaker_save(state)
+
+	# Network functions
+
+	def conn_get(self, scheme, netloc, timeout):
+		'''Return (conn, reused), taking an idle keep-alive connection
+		from the pool when there is one.'''
+		with self._lock:
+			idle = self._pool.get((scheme, netloc))
+			if idle:
+				return idle.pop(), True
+		if 'https' == scheme:
+			conn = http.client.HTTPSConnection(netloc, timeout = timeout)
+		elif 'http' == scheme:
+			conn = http.client.HTTPConnection(netloc, timeout = timeout)
+		else:
+			raise FetchError('Unsupported URL scheme: ' + scheme,
+					retriable = False)
+		conn.connect()
+		# Headers and body of a request are sent separately
+		conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		return conn, False
+
+	def conn_put(self, scheme, netloc, conn):
+		with self._lock:
+			idle = self._pool.setdefault((scheme, netloc), list())
+			if len(idle) < self.conf['pool_size']:
+				idle.append(conn)
+				return
+		conn.close()
+
+	def http_request(self, url, data, headers, deadline):
+		'''Send a single HTTP request, following redirects.
+		Return (status, headers, body) with the body decompressed.'''
+		conf = self.conf
+		for i in range(conf['max_redirects'] + 1):
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				raise FetchError('Deadline exceeded.')
+			parts = urllib.parse.urlsplit(url)
+			conn = None
+			try:
+				conn, reused = self.conn_get(parts.scheme, parts.netloc,
+						min(conf['timeout_connect'], remaining))
+				# Applies to every later read, the deadline is checked
+				# between reads
+				conn.sock.settimeout(min(conf['timeout_read'],
+					max(deadline - time.monotonic(), 0.001)))
+				path = urllib.parse.urlunsplit(('', '', parts.path or '/',
+						parts.query, ''))
+				try:
+					conn.request('POST' if data else 'GET', path, data,
+							headers)
+					resp = conn.getresponse()
+				except (ConnectionError, http.client.RemoteDisconnected):
+					if not reused:
+						raise
+					# The server closed the idle connection, try again
+					# on a fresh one
+					conn.close()
+					conn, reused = self.conn_get(parts.scheme, parts.netloc,
+							min(conf['timeout_connect'], remaining))
+					conn.sock.settimeout(min(conf['timeout_read'],
+						max(deadline - time.monotonic(), 0.001)))
+					conn.request('POST' if data else 'GET', path, data,
+							headers)
+					resp = conn.getresponse()
+				location = resp.getheader('Location')
+				if resp.status in (301, 302, 303, 307, 308) and location:
+					resp.read()
+					url = urllib.parse.urljoin(url, location)
+					if resp.status in (301, 302, 303):
+						data = None
+					report(LOGLEVELS.debug, 'Redirected to ' + url)
+				else:
+					decomp = None
+					if 'gzip' == resp.getheader('Content-Encoding'):
+						decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+					body = list()
+					size = 0
+					while True:
+						chunk = resp.read(65536)
+						if not chunk:
+							break
+						if decomp:
+							chunk = decomp.decompress(chunk,
+									conf['max_size'] - size + 1)
+						body.append(chunk)
+						size += len(chunk)
+						if size > conf['max_size']:
+							raise FetchError('Answer larger than {} bytes.'
+									.format(conf['max_size']),
+									retriable = False)
+						if time.monotonic() > deadline:
+							raise FetchError('Deadline exceeded while reading.')
+				if resp.isclosed() and not resp.will_close:
+					self.conn_put(parts.scheme, parts.netloc, conn)
+					conn = None
+				if location and resp.status in (301, 302, 303, 307, 308):
+					continue
+				return resp.status, resp, b''.join(body)
+			except (OSError, http.client.HTTPException, zlib.error) as e:
+				raise FetchError('{}: {}'.format(type(e).__name__, e))
+			finally:
+				if conn:
+					conn.close()
+		raise FetchError('Too many redirects.', retriable = False)
+
+	def fetch(self, url, data, check = None):
+		'''Fetch url with retries, jittered exponential backoff, a
+		per-query deadline and the circuit breaker, falling back to a stale
+		cache entry when all of these fail. Return the decoded body, or
+		with check, check(body): a downloaded body is only cached after
+		check accepted it, and one it rejects by raising Error fails the
+		request like an error of the server.'''
+		conf = self.conf
+		self.count('lookups')
+		key = cache_key(url, data)
+		meta, cached = self.cache_load(key)
+		if cached is not None \
+				and time.time() - meta['time'] < conf['cache_ttl']:
+			try:
+				result = check(cached) if check else cached
+				report(LOGLEVELS.info, 'Using cached result.')
+				self.count('cache_hits')
+				return result
+			except ServerError as e:
+				# Stored before answers were checked
+				report(LOGLEVELS.info, 'Ignoring cached result: ' + str(e))
+				meta = cached = None
+		self.count('cache_misses')
+		host = urllib.parse.urlsplit(url).netloc
+		headers = { 'User-Agent': urllib.request.URLopener.version
+				+ ' (e-file-py)', 'Accept-Encoding': 'gzip' }
+		if data:
+			headers['Content-Type'] = 'application/x-www-form-urlencoded'
+		if cached is not None:
+			if meta.get('etag'):
+				headers['If-None-Match'] = meta['etag']
+			if meta.get('last_modified'):
+				headers['If-Modified-Since'] = meta['last_modified']
+		report(LOGLEVELS.info, 'Sending request to the server...')
+		deadline = time.monotonic() + conf['deadline']
+		attempt = 0
+		err = None
+		# Whether the server failed, and whether it answered at all
+		failed = answered = False
+		while True:
+			if not self.breaker_allow(host):
+				if err is None:
+					err = FetchError('Circuit breaker is open, {} failed '
+							'repeatedly.'.format(host))
+				break
+			try:
+				status, resp, body = self.http_request(url, data, headers,
+						deadline)
+				self.count('requests')
+				self.count('bytes', len(body))
+				if 429 == status or status >= 500:
+					raise FetchError('Server returned HTTP {}.'.format(status))
+				answered = True
+				self.breaker_record(host, True)
+				if 304 == status and cached is not None:
+					meta['time'] = time.time()
+					self.cache_store(key, meta)
+					report(LOGLEVELS.info, 'Cached result revalidated.')
+					self.count('cache_revalidated')
+					return check(cached) if check else cached
+				if status >= 400:
+					raise FetchError('Server returned HTTP {}.'.format(status),
+							retriable = False)
+				str_raw = body.decode('utf-8')
+				result = check(str_raw) if check else str_raw
+				if str_raw:
+					self.cache_store(key, dict(url = url, time = time.time(),
+						etag = resp.getheader('ETag'),
+						last_modified = resp.getheader('Last-Modified')),
+						str_raw)
+				return result
+			except Error as e:
+				err = e
+			report(LOGLEVELS.info, 'Request failed: ' + str(err))
+			self.count('errors')
+			if not getattr(err, 'retriable', False):
+				break
+			failed = True
+			if attempt >= conf['retries']:
+				break
+			delay = random.uniform(0, min(conf['retry_backoff_max'],
+				conf['retry_backoff'] * 2 ** attempt))
+			if time.monotonic() + delay >= deadline:
+				break
+			attempt += 1
+			report(LOGLEVELS.info, 'Retrying in {:.2f}s ({}/{})...'.format(
+				delay, attempt, conf['retries']))
+			time.sleep(delay)
+		if failed and not answered:
+			self.breaker_record(host, False)
+		if cached is not None:
+			report(LOGLEVELS.warning, '{} Using a stale cached result from {}.'
+					.format(err, time.strftime('%Y-%m-%d %H:%M',
+					time.localtime(meta['time']))))
+			self.count('cache_stale')
+			return check(cached) if check else cached
+		raise err
+
+	# Query processing
+
+	def process_cp(self, arg):
+		if -1 == arg.find('/'):
+			if 'gentoo' != self.system:
+				raise QueryError(
+						'Without Portage API I could not expand package names.')
+			if arg not in self._cp_cache:
+				self._cp_cache[arg] = portage.dep_expand(arg, self.db_port)
+			arg = self._cp_cache[arg]
+			if arg.startswith('null/'):
+				raise QueryError('Failed to expand package name to CP.')
+		return tuple(arg.split('/', 1))
+
+	def process_cpv(self, arg):
+		if 'gentoo' != self.system:
+			raise QueryError('Without Portage API I could not split CPV.')
+		cp = portage.versions.pkgsplit(arg)[0]
+		ver = arg[len(cp) + 1:]
+		return tuple(self.process_cp(cp)) + (ver, )
+
+	def process_args_cp(self, args):
+		if 2 < len(args):
+			report(LOGLEVELS.warning, 'I see too many arguments.')
+			args = args[0:2]
+		if 1 == len(args):
+			return self.process_cp(args[0])
+		else:
+			return tuple(args)
+
+	def process_args_cpv(self, args):
+		if 3 < len(args):
+			report(LOGLEVELS.warning, 'I see too many arguments.')
+			args = args[0:3]
+		if 1 == len(args):
+			return self.process_cpv(args[0])
+		elif 2 == len(args):
+			return self.process_cp(args[0]) + (args[1], )
+		else:
+			return tuple(args)
+
+	def make_query(self, mode, args):
+		'''Build the query of mode from a list of command line style
+		arguments.'''
+		query = dict()
+		if 'cpvtof' == mode:
+			query['c'], query['p'], query['v'] = self.process_args_cpv(args)
+			query['cp'] = query['c'] + '/' + query['p']
+			query['cpv'] = query['cp'] + '-' + query['v']
+		elif 'cptov' == mode:
+			query['c'], query['p'] = self.process_args_cp(args)
+			query['cp'] = query['c'] + '/' + query['p']
+		else:
+			if 1 < len(args):
+				report(LOGLEVELS.warning, 'I see too many arguments.')
+			query['filename'] = args[0]
+		return query
+
+	# Core functions
+
+	def request_for(self, source, mode, query):
+		'''Return the URL and POST data of query.'''
+		conf = self.conf
+		data = (urllib.parse.urlencode(
+				{ key: value.format(**query) for key, value
+				in conf['req_data'][source][mode].items() })
+				.encode('iso8859-1')
+				if conf['req_data'][source][mode] else None)
+		url = conf['base_url'] + conf['req_url'][source][mode].format(**query)
+		return url, data
+
+	def read_result(self, source, mode, query, parse = False):
+		'''Return the answer of the server to query, or with parse, the
+		answer parsed by parse(), in which case only answers that parse
+		are cached.'''
+		query['req_url'], query['req_data'] = \
+				self.request_for(source, mode, query)
+		report(LOGLEVELS.debug, repr([query['req_url'], query['req_data']]))
+		start = time.perf_counter()
+		timed = False
+
+		def check(str_raw):
+			nonlocal timed
+			if not timed:
+				timed = True
+				self.observe('stage_seconds', time.perf_counter() - start,
+						stage = 'read_result')
+			if not str_raw:
+				raise FetchError('I got no data from the server!',
+						retriable = False)
+			report(LOGLEVELS.info, 'Result retrieved.')
+			self.dbg_write('output.html', str_raw)
+			if parse:
+				return self.parse(source, mode, query, str_raw)
+			return str_raw
+
+		return self.fetch(query['req_url'], query['req_data'], check)
+
+	def parse(self, source, mode, query, str_raw):
+		'''Parse str_raw with parse_result(), in a worker process if
+		conf['parse_workers'] is set. Only the raw answer and the parsed
+		result, plain dicts and lists, cross the process boundary.'''
+		if not self.conf['parse_workers']:
+			with self.timed('parse_result'):
+				return parse_result(source, mode, query, str_raw,
+						base_url = self.conf['base_url'])
+		with self._lock:
+			if not self._parse_pool:
+				# Forking a process running threads is unsafe
+				self._parse_pool = concurrent.futures.ProcessPoolExecutor(
+						self.conf['parse_workers'],
+						mp_context = multiprocessing.get_context('spawn'))
+		with self.timed('parse_result'):
+			return self._parse_pool.submit(parse_result, source, mode, query,
+					str_raw, self.conf['base_url']).result()
+
+	def lookup(self, mode, query, source = None):
+		'''Fetch and parse the result of query, without extra
+		information.'''
+		source = source or self.conf['source']
+		self.count(metric_key('queries', mode = mode, source = source))
+		try:
+			return self.read_result(source, mode, query, parse = True)
+		except Error as e:
+			self.count(metric_key('query_errors', error = type(e).__name__,
+				mode = mode, source = source))
+			raise
+
+	def lookup_many(self, requests):
+		'''Look up many (mode, args) requests with conf['jobs'] threads.
+		Yield (request, query, result) as they complete, with result
+		being an Error instance on failure. requests is read in a thread
+		of its own, at most 2 * conf['jobs'] requests ahead of the
+		results, so that results are yielded while a slow iterable, like
+		a pipe, is still being read.'''
+		requests = iter(requests)
+		end = object()
+
+		def read_next():
+			# A daemon thread, which does not keep the interpreter alive
+			# while it waits for input no one wants anymore
+			future = concurrent.futures.Future()
+
+			def read():
+				try:
+					future.set_result(next(requests, end))
+				except BaseException as e:
+					future.set_exception(e)
+
+			threading.Thread(target = read, daemon = True).start()
+			return future
+
+		executor = concurrent.futures.ThreadPoolExecutor(self.conf['jobs'])
+		futures = dict()
+		try:
+			reading = read_next()
+			while reading or futures:
+				waiting = set(futures)
+				if reading and len(futures) < 2 * self.conf['jobs']:
+					waiting.add(reading)
+				done = concurrent.futures.wait(waiting,
+						return_when = concurrent.futures.FIRST_COMPLETED).done
+				for future in done:
+					if future is not reading:
+						request, query = futures.pop(future)
+						try:
+							yield request, query, future.result()
+						except Error as e:
+							yield request, query, e
+						continue
+					request = future.result()
+					if request is end:
+						reading = None
+						continue
+					reading = read_next()
+					mode, args = request
+					try:
+						query = self.make_query(mode, args)
+					except Error as e:
+						yield request, None, e
+						continue
+					futures[executor.submit(self.lookup, mode, query)] = \
+							(request, query)
+		finally:
+			for future in futures:
+				future.cancel()
+			executor.shutdown(wait = True)
+
+	def extra_info(self, mode, query, cp, cp_group):
+		# Get cp-specific information
+		cp_group['exists'] = False
+		cp_group['installed_flag'] = ''
+		if 'gentoo' == self.system:
+			p_installed = self.db_installed.match(cp)
+			cp_group['ver_installed'] = plist_getver(p_installed)
+			p_available = self.db_port.match(cp)
+			cp_group['ver_available'] = plist_getver(p_available)
+			cp_group['ver_installed'].sort(key = sort_key_ver)
+			cp_group['ver_available'].sort(key = sort_key_ver)
+			if p_available:
+				extra_metadata = self.db_port.aux_get(p_available[-1],
+						[ 'HOMEPAGE', 'DESCRIPTION' ])
+				cp_group['homepage'] = extra_metadata[0]
+				cp_group['description'] = extra_metadata[1]
+		# Fill empty properties
+		for i in { 'homepage', 'description' }:
+			if i not in cp_group:
+				cp_group[i] = ''
+		for i in { 'ver_installed', 'ver_available' }:
+			if i not in cp_group:
+				cp_group[i] = list()
+		for ver, ver_group in cp_group['ver_groups'].items():
+			ver_group['exists'] = False
+			# Get path-specific information
+			for path, path_group in ver_group['path_groups'].items():
+				path_group['exists'] = os.path.exists(path)
+				if path_group['exists']:
+					ver_group['exists'] = True
+			if ver_group['exists']:
+				cp_group['exists'] = True
+			# Get ver-specific information
+			ver_group['installed_flag'] = ''
+			if 'gentoo' != self.system or not cp_group['ver_installed']:
+				continue
+			if ver:
+				if ver in cp_group['ver_installed']:
+					ver_group['installed_flag'] = 'installed'
+					cp_group['installed_flag'] = 'installed'
+				else:
+					if vercmp_func(ver,
+							cp_group['ver_installed'][-1]) > 0:
+						ver_group['installed_flag'] = 'upgrade'
+						if '' == cp_group['installed_flag']:
+							cp_group['installed_flag'] = 'upgrade'
+					else:
+						ver_group['installed_flag'] = 'downgrade'
+						if 'installed' != cp_group['installed_flag']:
+							cp_group['installed_flag'] = 'downgrade'
+			else:
+				ver_group['installed_flag'] = 'installed'
+				cp_group['installed_flag'] = 'installed'
+		report(LOGLEVELS.debug, 'cp_group = ' + repr(cp_group))
+		return cp_group
+
+	def records(self, mode, query, result, filters = (), output = 'json'):
+		'''Yield the structured records of result one cp at a time,
+		consuming result. See structured_records().'''
+		filters = filter_check(filters)
+		for cp in sorted(result):
+			cp_group = result.pop(cp)
+			if not self.conf['minimal']:
+				self.extra_info(mode, query, cp, cp_group)
+				if not filter_cp(cp_group, filters):
+					continue
+			yield from structured_records(mode, cp, cp_group, output)
+
+	# Library API
+
+	def find_file(self, filename, all_versions = False, filters = ()):
+		'''Return a record for each package containing a file named
+		filename, with the matched versions and paths nested.'''
+		mode = 'allver' if all_versions else 'uniq'
+		query = self.make_query(mode, [ filename ])
+		return list(self.records(mode, query, self.lookup(mode, query),
+				filters))
+
+	def list_files(self, cpv):
+		'''Return a record for each file of cpv. cpv is a string, or a
+		(category, package, version) tuple.'''
+		query = self.make_query('cpvtof',
+				[ cpv ] if isinstance(cpv, str) else list(cpv))
+		return list(self.records('cpvtof', query,
+				self.lookup('cpvtof', query), output = 'ndjson'))
+
+	def list_versions(self, cp):
+		'''Return a record for each version of cp known to PFL. cp is a
+		string, or a (category, package) tuple.'''
+		query = self.make_query('cptov',
+				[ cp ] if isinstance(cp, str) else list(cp))
+		return list(self.records('cptov', query,
+				self.lookup('cptov', query), output = 'ndjson'))
+
+	def audit(self, atoms = (), progress = None):
+		'''Compare the PFL file lists of installed packages with their
+		CONTENTS and the file system. Yield a record for each file listed
+		by PFL but missing locally ('missing', with in_contents telling
+		whether the package was merged with it) or installed but not
+		listed by PFL ('unexpected'), plus one per package without a PFL
+		record ('norecord') or whose list could not be fetched ('error').
+		PFL merges the reports of all arches and USE flag settings, so
+		files reported only for other arches, or only with USE flags
+		not enabled for the installed package, are not expected to
+		exist. The file lists are fetched by conf['jobs'] threads.
+		progress is called with (done, total) after each package.'''
+		if 'gentoo' != self.system:
+			raise QueryError('Auditing installed packages requires Portage.')
+		if atoms:
+			cpvs = sorted({ cpv for atom in atoms
+					for cpv in self.db_installed.match(atom) })
+		else:
+			cpvs = sorted(self.db_installed.cpv_all())
+		arch = self.db_port.settings['ARCH']
+		scanner = DirScanner()
+
+		def expected(path_group, use):
+			archs = path_group.get('arch')
+			flags = path_group.get('use')
+			return (not archs or arch in archs) \
+					and (not flags or not use.isdisjoint(flags))
+
+		executor = concurrent.futures.ThreadPoolExecutor(self.conf['jobs'])
+		try:
+			futures = dict()
+			for cpv in cpvs:
+				query = self.make_query('cpvtof', [ cpv ])
+				futures[executor.submit(self.lookup, 'cpvtof', query)] = cpv
+			for done, future in enumerate(
+					concurrent.futures.as_completed(futures), 1):
+				cpv = futures.pop(future)
+				try:
+					result = future.result()
+				except Error as e:
+					yield dict(cpv = cpv, status = 'error', message = str(e))
+					continue
+				finally:
+					if progress:
+						progress(done, len(cpvs))
+				path_groups = { path: path_group
+						for cp_group in result.values()
+						for ver_group in cp_group['ver_groups'].values()
+						for path, path_group
+						in ver_group['path_groups'].items() }
+				if not path_groups:
+					yield dict(cpv = cpv, status = 'norecord')
+					continue
+				try:
+					local_paths = contents_read(
+							self.db_installed.getpath(cpv, 'CONTENTS'))
+				except OSError:
+					local_paths = set()
+				use = set(self.db_installed.aux_get(cpv, [ 'USE' ])[0].split())
+				pfl_paths = { path for path, path_group in path_groups.items()
+						if expected(path_group, use) }
+				for path in sorted(pfl_paths):
+					if not scanner.exists(path):
+						yield dict(cpv = cpv, status = 'missing', path = path,
+								in_contents = path in local_paths)
+				for path in sorted(local_paths - path_groups.keys()):
+					yield dict(cpv = cpv, status = 'unexpected', path = path)
+				self.count('audit_files', len(pfl_paths))
+		finally:
+			for future in futures:
+				future.cancel()
+			executor.shutdown(wait = True)
+
+	def file_table(self, query):
+		'''Look up the cpvtof query and return its files as a compact
+		{path: (arch, use)} dict, sharing equal (arch, use) tuples.'''
+		table = dict()
+		flags = dict()
+		result = self.lookup('cpvtof', query)
+		for cp_group in result.values():
+			for ver_group in cp_group['ver_groups'].values():
+				for path, path_group in ver_group['path_groups'].items():
+					key = (tuple(sorted(path_group.get('arch', ()))),
+							tuple(sorted(path_group.get('use', ()))))
+					table[path] = flags.setdefault(key, key)
+		return table
+
+	def diff(self, cp, versions = ()):
+		'''Compare the PFL file lists of consecutive versions of cp.
+		Without versions the newest installed version is compared with
+		the newest available one, a single version is compared with the
+		newest installed one. Yield a record per path added, removed or
+		changed in arch or USE flags.'''
+		c, p = self.process_cp(cp)
+		cp = c + '/' + p
+		versions = list(versions)
+		if len(versions) < 2:
+			if 'gentoo' != self.system:
+				raise QueryError('Without Portage API I need two versions '
+						'to compare.')
+			installed = sorted(plist_getver(self.db_installed.match(cp)),
+					key = sort_key_ver)
+			if not installed:
+				raise QueryError(cp + ' is not installed.')
+			if not versions:
+				available = sorted(plist_getver(self.db_port.match(cp)),
+						key = sort_key_ver)
+				if not available:
+					raise QueryError(cp + ' is not available.')
+				versions = available[-1:]
+			versions = installed[-1:] + versions
+		report(LOGLEVELS.info, 'Comparing ' + ', '.join(versions))
+		# The first two file lists are fetched concurrently, and the one
+		# after the next while two are compared, but no more, which bounds
+		# memory use for packages with huge file lists to three compact
+		# tables and the answers being parsed.
+		queries = [ self.make_query('cpvtof', [ c, p, v ]) for v in versions ]
+		with concurrent.futures.ThreadPoolExecutor(2) as executor:
+			futures = collections.deque(executor.submit(self.file_table,
+				query) for query in queries[:2])
+			old = None
+			for i in range(len(versions)):
+				new = futures.popleft().result()
+				if old is not None:
+					yield from diff_tables(dict(cp = cp,
+						ver_from = versions[i - 1], ver_to = versions[i]),
+						old, new)
+				old = new
+				if i + 2 < len(queries):
+					futures.append(executor.submit(self.file_table,
+						queries[i + 2]))
+
+	def missing_libs(self, paths):
+		'''Yield dict(library, needed_by, package, candidates) for each
+		library needed by the ELF files paths, directly or through the
+		libraries they load, that is not found in the library search path.
+		package is the one PFL most likely installs it from, None if
+		unknown. All libraries are looked up in one batch of concurrent
+		uniq queries; on failure, error is set.'''
+		missing = elf_missing(paths)
+		for (mode, args), query, result in self.lookup_many(
+				('uniq', [ name ]) for name in missing):
+			need = missing[args[0]]
+			rec = dict(library = args[0], needed_by = need['needed_by'],
+					package = None, candidates = list())
+			if isinstance(result, Error):
+				rec['error'] = str(result)
+			else:
+				rec['candidates'] = lib_candidates(result, need['elf_class'],
+						need['machine'])
+				if rec['candidates']:
+					rec['package'] = rec['candidates'][0]
+			yield rec
+
+	def warm_queries(self):
+		'''Yield (mode, query) of likely lookups: the recorded history,
+		most recent first, then the versions of installed packages and the
+		names of installed executables and libraries.'''
+		seen = set()
+		for mode, args in reversed(self.history_read()):
+			if (mode, tuple(args)) in seen:
+				continue
+			seen.add((mode, tuple(args)))
+			try:
+				yield mode, self.make_query(mode, args)
+			except Error:
+				continue
+		if 'gentoo' != self.system:
+			return
+		cpvs = sorted(self.db_installed.cpv_all())
+		for cp in sorted({ portage.versions.pkgsplit(cpv)[0]
+				for cpv in cpvs }):
+			if ('cptov', (cp, )) not in seen:
+				yield 'cptov', self.make_query('cptov', [ cp ])
+		names = set()
+		for cpv in cpvs:
+			try:
+				paths = contents_read(self.db_installed.getpath(cpv,
+					'CONTENTS'))
+			except OSError:
+				continue
+			names.update(os.path.basename(path) for path in paths
+					if is_lookup_target(path))
+		for name in sorted(names):
+			if ('uniq', (name, )) not in seen:
+				yield 'uniq', self.make_query('uniq', [ name ])
+
+	def warm(self, progress = None):
+		'''Fetch likely lookups (see warm_queries()) into the response
+		cache, stopping after conf['warm_time'] seconds or
+		conf['warm_bytes'] downloaded bytes. Queries with a fresh cache
+		entry are skipped, so a run cut short by its budget is resumed by
+		the next one. progress is called with (requests, None) after each
+		request and (requests, requests) at the end. Return a Counter of
+		the outcomes.'''
+		conf = self.conf
+		if not conf['cache']:
+			raise QueryError('Warming requires the response cache.')
+		counts = collections.Counter()
+		stats_before = collections.Counter(self.stats)
+		deadline = time.monotonic() + conf['warm_time']
+
+		def collect(futures):
+			for future in futures:
+				try:
+					future.result()
+					counts['fetched'] += 1
+				except Error:
+					counts['errors'] += 1
+				if progress:
+					progress(counts['fetched'] + counts['errors'], None)
+
+		pending = set()
+		with concurrent.futures.ThreadPoolExecutor(conf['jobs']) as executor:
+			for mode, query in self.warm_queries():
+				if time.monotonic() >= deadline or self.stats['bytes'] \
+						- stats_before['bytes'] >= conf['warm_bytes']:
+					counts['budget_exhausted'] = 1
+					break
+				url, data = self.request_for(conf['source'], mode, query)
+				if self.cache_fresh(cache_key(url, data)):
+					counts['fresh'] += 1
+					continue
+				if len(pending) >= 2 * conf['jobs']:
+					done, pending = concurrent.futures.wait(pending,
+							return_when = concurrent.futures.FIRST_COMPLETED)
+					collect(done)
+				pending.add(executor.submit(self.read_result, conf['source'],
+					mode, query, parse = True))
+			collect(concurrent.futures.as_completed(pending))
+		if progress:
+			progress(counts['fetched'] + counts['errors'],
+					counts['fetched'] + counts['errors'])
+		# Keep warming out of the lookup statistics
+		with self._lock:
+			delta = self.stats - stats_before
+			self.stats -= delta
+			self.stats.update({ 'warm_' + key: value
+					for key, value in delta.items() })
+			self.stats['warm_runs'] += 1
+		return counts
+
+	def completion_rebuild(self, options = (), watch = ()):
+		'''Build the tables of efilecompletion. The Portage tree tables
+		are only regenerated for categories whose directories changed
+		since the last build, the other lines are copied over. options
+		are the option strings of the command line interface; a change
+		to one of the files in watch, like the script defining them,
+		makes the tables stale.'''
+		tdir = efilecompletion.table_dir(self.conf['cache_dir'])
+		os.makedirs(tdir, exist_ok = True)
+		marker = os.path.join(tdir, 'rebuilding')
+		open(marker, 'w').close()
+		try:
+			self._completion_rebuild(tdir, options, watch)
+		finally:
+			os.remove(marker)
+
+	def _completion_rebuild(self, tdir, options, extra_watch):
+		def mtime(path):
+			try:
+				return os.stat(path).st_mtime
+			except OSError:
+				return None
+
+		def table(name):
+			return os.path.join(tdir, name)
+
+		try:
+			with open(table('stamps.json'), 'r') as f:
+				old_stamps = json.load(f)
+		except (OSError, ValueError):
+			old_stamps = dict()
+		old_categories = old_stamps.get('categories', dict())
+		stamps = dict(watch = dict(), categories = dict())
+		watch = stamps['watch']
+		for path in extra_watch:
+			watch[path] = mtime(path)
+		efilecompletion.table_write(table('options'), options)
+		names = { args[0] for mode, args in self.history_read()
+				if mode in ('uniq', 'allver') and args }
+		if 'gentoo' != self.system:
+			watch[os.path.join(self.conf['cache_dir'], 'history')] = \
+					mtime(os.path.join(self.conf['cache_dir'], 'history'))
+			efilecompletion.table_write(table('files'), names)
+			for name in ('cp', 'pn', 'cpv', 'installed'):
+				efilecompletion.table_write(table(name), ())
+		else:
+			trees = self.db_port.porttrees
+			for tree in trees:
+				chk = os.path.join(tree, 'metadata', 'timestamp.chk')
+				path = chk if os.path.exists(chk) else tree
+				watch[path] = mtime(path)
+			cp_lines = list()
+			cpv_lines = list()
+			reused = 0
+			for cat in sorted(self.db_port.settings.categories):
+				# A new version touches the package directory, a new or
+				# removed package the category directory
+				sig = list()
+				for tree in trees:
+					cat_dir = os.path.join(tree, cat)
+					sig.append(mtime(cat_dir))
+					try:
+						with os.scandir(cat_dir) as it:
+							sig.append(max((entry.stat().st_mtime
+								for entry in it if entry.is_dir()),
+								default = None))
+					except OSError:
+						sig.append(None)
+				stamps['categories'][cat] = sig
+				if old_categories.get(cat) == sig:
+					cp_lines += efilecompletion.prefix_search(table('cp'),
+							cat + '/')
+					cpv_lines += efilecompletion.prefix_search(table('cpv'),
+							cat + '/')
+					reused += 1
+					continue
+				for cp in self.db_port.cp_all(categories = [ cat ]):
+					cp_lines.append(cp)
+					cpv_lines += self.db_port.cp_list(cp)
+			report(LOGLEVELS.info, 'Reused {} of {} categories.'.format(reused,
+				len(stamps['categories'])))
+			efilecompletion.table_write(table('cp'), cp_lines)
+			efilecompletion.table_write(table('pn'),
+					(cp.split('/', 1)[1] for cp in cp_lines))
+			efilecompletion.table_write(table('cpv'), cpv_lines)
+			# Installed packages change with every merge, which updates
+			# the counter file
+			eroot = self.db_port.settings['EROOT']
+			vdb = os.path.join(eroot, portage.const.VDB_PATH)
+			counter = os.path.join(eroot, portage.const.CACHE_PATH, 'counter')
+			watch[vdb] = mtime(vdb)
+			watch[counter] = mtime(counter)
+			cpvs = self.db_installed.cpv_all()
+			efilecompletion.table_write(table('installed'), cpvs)
+			old_watch = old_stamps.get('watch', dict())
+			if vdb in old_watch and old_watch[vdb] == watch[vdb] \
+					and old_watch.get(counter) == watch[counter]:
+				names.update(efilecompletion.prefix_search(table('files'), ''))
+			else:
+				for cpv in cpvs:
+					try:
+						names.update(os.path.basename(path) for path
+								in contents_read(self.db_installed.getpath(
+								cpv, 'CONTENTS')))
+					except OSError:
+						continue
+			efilecompletion.table_write(table('files'), names)
+		with open(table('stamps.json.tmp'), 'w') as f:
+			json.dump(stamps, f)
+		os.replace(table('stamps.json.tmp'), table('stamps.json'))
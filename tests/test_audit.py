@@ -0,0 +1,124 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# efilepy.Session.audit() and the exit status of -A, with a file list
+# served by a local stub server and a fake installed package database.
+
+import sys, os, io, json, types, tempfile, contextlib, importlib.util
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import efilepy
+from stubserver import StubServer
+
+spec = importlib.util.spec_from_file_location('e_file_py',
+		os.path.join(ROOT, 'e-file-py.py'))
+cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cli)
+
+CPV = 'app-misc/foo-1.0'
+
+class FakeVardb:
+	def __init__(self, contents, use):
+		self.contents = contents
+		self.use = use
+
+	def cpv_all(self):
+		return [ CPV ]
+
+	def match(self, atom):
+		return [ CPV ]
+
+	def getpath(self, cpv, name):
+		return self.contents
+
+	def aux_get(self, cpv, keys):
+		return [ self.use ]
+
+class AuditTest(unittest.TestCase):
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.dir = tmp.name
+		self.contents = os.path.join(self.dir, 'CONTENTS')
+		patcher = mock.patch.object(efilepy, 'portage',
+				types.SimpleNamespace(versions = types.SimpleNamespace(
+				pkgsplit = lambda cpv: ('app-misc/foo', '1.0', 'r0'))),
+				create = True)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def path(self, name):
+		return os.path.join(self.dir, name)
+
+	def write_contents(self, names):
+		with open(self.contents, 'w') as f:
+			for name in names:
+				f.write('obj {} d41d8cd98f00b204e9800998ecf8427e 1\n'.format(
+					self.path(name)))
+
+	def session(self, stub, use = 'amd64 doc'):
+		session = efilepy.Session(source = 'pfl_json', base_url = stub.base_url,
+				cache = False)
+		self.addCleanup(session.close)
+		session.system = 'gentoo'
+		session.db_installed = FakeVardb(self.contents, use)
+		session.db_port = types.SimpleNamespace(settings = dict(ARCH = 'amd64'))
+		return session
+
+	def answer(self, files):
+		'''Return the cpvtof answer listing files, {name: (archs, use)}
+		below the temporary directory.'''
+		return json.dumps(dict(result = [ dict(category = 'app-misc',
+			package = 'foo', version = '1.0',
+			path = os.path.dirname(self.path(name)),
+			file = os.path.basename(name), type = [ 'obj' ], archs = archs,
+			useflags = use) for name, (archs, use) in files.items() ])) \
+			.encode('utf-8')
+
+	def test_arch_and_use(self):
+		open(self.path('foo'), 'w').close()
+		self.write_contents([ 'foo', 'gone', 'extra' ])
+		answer = self.answer({
+				'foo': ([ 'amd64', 'x86' ], []),
+				'gone': ([ 'amd64' ], []),
+				'x86only': ([ 'x86' ], []),
+				'manual': ([ 'amd64' ], [ 'doc', 'gtk' ]),
+				'gtkonly': ([ 'amd64' ], [ 'gtk' ]),
+				'unknown': ([], []),
+		})
+		with StubServer({ '': answer }) as stub:
+			records = list(self.session(stub).audit())
+		self.assertEqual([
+			dict(cpv = CPV, status = 'missing', path = self.path('gone'),
+				in_contents = True),
+			dict(cpv = CPV, status = 'missing', path = self.path('manual'),
+				in_contents = False),
+			dict(cpv = CPV, status = 'missing', path = self.path('unknown'),
+				in_contents = False),
+			dict(cpv = CPV, status = 'unexpected', path = self.path('extra')),
+		], records)
+
+	def test_norecord(self):
+		self.write_contents([])
+		with StubServer({ '': json.dumps(dict(result = [])).encode('utf-8') }) \
+				as stub:
+			self.assertEqual([ dict(cpv = CPV, status = 'norecord') ],
+					list(self.session(stub).audit()))
+
+	def test_exit_status(self):
+		args = types.SimpleNamespace(query = [])
+		self.write_contents([ 'gone' ])
+		for names, status in (([ 'masked' ], 0), ([ 'masked', 'gone' ], 1)):
+			with self.subTest(names = names), StubServer({ '': self.answer({
+					name: ([ 'amd64' ], []) for name in names }) }) as stub, \
+					contextlib.redirect_stdout(io.StringIO()), \
+					contextlib.redirect_stderr(io.StringIO()):
+				self.assertEqual(status, cli.run_audit(self.session(stub), args))
+
+if '__main__' == __name__:
+	unittest.main()
@@ -0,0 +1,85 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# efilepy.Session.diff() against file lists served by a local stub
+# server.
+
+import sys, os, json, time, unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import efilepy
+from stubserver import StubServer
+
+URL = '/site/query/robotListPackageFiles?category=app-misc&package=foo' \
+		'&version={}'
+
+def answer(version, files):
+	'''Return the cpvtof answer of app-misc/foo-version listing files,
+	{path: (archs, useflags)}.'''
+	return json.dumps(dict(result = [ dict(category = 'app-misc',
+		package = 'foo', version = version, path = os.path.dirname(path),
+		file = os.path.basename(path), type = [ 'obj' ], archs = archs,
+		useflags = use) for path, (archs, use) in files.items() ])) \
+		.encode('utf-8')
+
+RESPONSES = {
+		URL.format('1.0'): answer('1.0', {
+			'/usr/bin/foo': ([ 'amd64', 'x86' ], []),
+			'/usr/lib/foo.so': ([ 'x86' ], []),
+			'/usr/share/foo/a': ([ 'amd64' ], [ 'doc' ]),
+		}),
+		URL.format('2.0'): answer('2.0', {
+			'/usr/bin/foo': ([ 'amd64', 'x86' ], []),
+			'/usr/share/foo/a': ([ 'amd64', 'x86' ], [ 'doc' ]),
+			'/usr/share/foo/b': ([ 'amd64' ], []),
+		}),
+		URL.format('3.0'): answer('3.0', {
+			'/usr/bin/foo': ([ 'amd64', 'x86' ], []),
+		}),
+}
+
+class DiffTest(unittest.TestCase):
+	def diff(self, stub, versions):
+		with efilepy.Session(source = 'pfl_json', base_url = stub.base_url,
+				cache = False) as session:
+			return list(session.diff('app-misc/foo', versions))
+
+	def test_records(self):
+		with StubServer(RESPONSES) as stub:
+			records = self.diff(stub, [ '1.0', '2.0', '3.0' ])
+		base = dict(cp = 'app-misc/foo', ver_from = '1.0', ver_to = '2.0')
+		self.assertEqual([
+			dict(base, status = 'removed', path = '/usr/lib/foo.so',
+				arch = [ 'x86' ], use = []),
+			dict(base, status = 'changed', path = '/usr/share/foo/a',
+				arch_from = [ 'amd64' ], arch_to = [ 'amd64', 'x86' ],
+				use_from = [ 'doc' ], use_to = [ 'doc' ]),
+			dict(base, status = 'added', path = '/usr/share/foo/b',
+				arch = [ 'amd64' ], use = []),
+		], records[:3])
+		self.assertEqual([ ('2.0', '3.0', 'removed', '/usr/share/foo/a'),
+			('2.0', '3.0', 'removed', '/usr/share/foo/b') ],
+			[ (rec['ver_from'], rec['ver_to'], rec['status'], rec['path'])
+			for rec in records[3:] ])
+
+	def test_overlap(self):
+		# The first two file lists are fetched at the same time, the third
+		# while they are compared
+		with StubServer(RESPONSES, latency = 0.5) as stub:
+			start = time.monotonic()
+			self.diff(stub, [ '1.0', '2.0' ])
+			self.assertLess(time.monotonic() - start, 0.9)
+			start = time.monotonic()
+			self.diff(stub, [ '1.0', '2.0', '3.0' ])
+			self.assertLess(time.monotonic() - start, 1.4)
+
+	def test_error(self):
+		with StubServer(RESPONSES) as stub, \
+				self.assertRaises(efilepy.FetchError):
+			self.diff(stub, [ '1.0', '4.0' ])
+
+if '__main__' == __name__:
+	unittest.main()
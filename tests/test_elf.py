@@ -0,0 +1,173 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# The ELF reader and the library lookup of -M, on small ELF files built
+# here.
+
+import sys, os, struct, tempfile, unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import efilepy
+
+EM_X86_64 = 62
+EM_PPC = 20
+
+def build_elf(elf_class = 64, end = '<', machine = EM_X86_64, needed = (),
+		rpath = None, runpath = None):
+	'''Return an ELF file of one PT_LOAD segment, mapped at 0x1000, and a
+	PT_DYNAMIC segment with the given entries.'''
+	if 32 == elf_class:
+		ehdr, phdr, dyn = 'HHIIIIIHHHHHH', 'IIIIIIII', 'iI'
+	else:
+		ehdr, phdr, dyn = 'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'
+	ehdr_size = 16 + struct.calcsize(end + ehdr)
+	phdr_size = struct.calcsize(end + phdr)
+	dyn_size = struct.calcsize(end + dyn)
+	strtab = b'\0'
+	entries = list()
+	for tag, strings in [ (1, name) for name in needed ] \
+			+ [ (15, rpath), (29, runpath) ]:
+		if strings is not None:
+			entries.append((tag, len(strtab)))
+			strtab += strings.encode('utf-8') + b'\0'
+	dyn_off = ehdr_size + 2 * phdr_size
+	strtab_off = dyn_off + (len(entries) + 2) * dyn_size
+	entries += [ (5, 0x1000 + strtab_off), (0, 0) ]
+	size = strtab_off + len(strtab)
+
+	ident = b'\x7fELF' + bytes([ 1 if 32 == elf_class else 2,
+		1 if '<' == end else 2, 1 ]) + bytes(9)
+	data = ident + struct.pack(end + ehdr, 3, machine, 1, 0, ehdr_size, 0, 0,
+			ehdr_size, phdr_size, 2, 0, 0, 0)
+	for p_type, offset, vaddr, filesz in ((1, 0, 0x1000, size),
+			(2, dyn_off, 0x1000 + dyn_off, size - dyn_off)):
+		if 32 == elf_class:
+			data += struct.pack(end + phdr, p_type, offset, vaddr, vaddr,
+					filesz, filesz, 4, 0x1000)
+		else:
+			data += struct.pack(end + phdr, p_type, 4, offset, vaddr, vaddr,
+					filesz, filesz, 0x1000)
+	for tag, val in entries:
+		data += struct.pack(end + dyn, tag, val)
+	return data + strtab
+
+class ElfTest(unittest.TestCase):
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.dir = tmp.name
+		# Keep the libraries of this system out of the lookups
+		patcher = mock.patch.dict(os.environ, LD_LIBRARY_PATH = '')
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def write(self, name, data):
+		path = os.path.join(self.dir, name)
+		os.makedirs(os.path.dirname(path), exist_ok = True)
+		with open(path, 'wb') as f:
+			f.write(data)
+		return path
+
+	def test_read_classes_and_byte_orders(self):
+		for elf_class, end, machine in ((32, '<', 3), (32, '>', EM_PPC),
+				(64, '<', EM_X86_64), (64, '>', 21)):
+			with self.subTest(elf_class = elf_class, end = end):
+				path = self.write('bin', build_elf(elf_class, end, machine,
+					needed = [ 'libfoo.so.1', 'libc.so.6' ]))
+				self.assertEqual(dict(elf_class = elf_class, machine = machine,
+					needed = [ 'libfoo.so.1', 'libc.so.6' ], rpath = [],
+					runpath = []), efilepy.elf_read(path))
+
+	def test_read_paths(self):
+		path = self.write('bin', build_elf(needed = [ 'libfoo.so.1' ],
+			rpath = '$ORIGIN/../lib::/opt/lib', runpath = '${ORIGIN}'))
+		info = efilepy.elf_read(path)
+		self.assertEqual([ '$ORIGIN/../lib', '/opt/lib' ], info['rpath'])
+		self.assertEqual([ '${ORIGIN}' ], info['runpath'])
+
+	def test_read_truncated(self):
+		data = build_elf(needed = [ 'libfoo.so.1' ])
+		path = self.write('bin', data[:80])
+		with self.assertRaisesRegex(efilepy.QueryError, 'truncated'):
+			efilepy.elf_read(path)
+
+	def test_read_not_elf(self):
+		for data in (b'#! /bin/sh\necho hello\n', b'', b'\x7fELF\x03\x01'):
+			with self.subTest(data = data):
+				path = self.write('script', data)
+				with self.assertRaisesRegex(efilepy.QueryError,
+						'not an ELF file'):
+					efilepy.elf_read(path)
+		with self.assertRaises(efilepy.QueryError):
+			efilepy.elf_read(os.path.join(self.dir, 'nonexistent'))
+
+	def test_missing_and_present(self):
+		self.write('lib/libpresent-efilepy.so.1', build_elf(
+			needed = [ 'libdeep-efilepy.so.2' ]))
+		path = self.write('bin/prog', build_elf(needed = [
+			'libpresent-efilepy.so.1', 'libabsent-efilepy.so.1' ],
+			rpath = '$ORIGIN/../lib'))
+		missing = efilepy.elf_missing([ path ])
+		self.assertEqual([ 'libabsent-efilepy.so.1', 'libdeep-efilepy.so.2' ],
+				list(missing))
+		self.assertEqual(dict(needed_by = [ path ], elf_class = 64,
+			machine = EM_X86_64), missing['libabsent-efilepy.so.1'])
+		# Needed by the library found through $ORIGIN
+		self.assertEqual([ os.path.join(self.dir, 'bin', '..', 'lib',
+			'libpresent-efilepy.so.1') ],
+			missing['libdeep-efilepy.so.2']['needed_by'])
+
+	def test_missing_needed_by_deduplicated(self):
+		needed = [ 'libabsent-efilepy.so.1', 'libabsent-efilepy.so.1' ]
+		first = self.write('first', build_elf(needed = needed))
+		second = self.write('second', build_elf(needed = needed))
+		missing = efilepy.elf_missing([ first, second, first ])
+		self.assertEqual([ first, second ],
+				missing['libabsent-efilepy.so.1']['needed_by'])
+
+	def test_missing_runpath_over_rpath(self):
+		self.write('a/libfoo-efilepy.so.1', build_elf())
+		path = self.write('prog', build_elf(needed = [ 'libfoo-efilepy.so.1' ],
+			rpath = '$ORIGIN/a', runpath = '$ORIGIN/b'))
+		self.assertIn('libfoo-efilepy.so.1', efilepy.elf_missing([ path ]))
+		self.write('b/libfoo-efilepy.so.1', build_elf())
+		self.assertEqual(dict(), efilepy.elf_missing([ path ]))
+
+	def test_missing_incompatible(self):
+		# A library of another class or machine is skipped, like ld.so does
+		self.write('lib/libfoo-efilepy.so.1', build_elf(32, '>', EM_PPC))
+		path = self.write('prog', build_elf(needed = [ 'libfoo-efilepy.so.1' ],
+			runpath = '$ORIGIN/lib'))
+		self.assertIn('libfoo-efilepy.so.1', efilepy.elf_missing([ path ]))
+
+	def test_missing_not_elf(self):
+		path = self.write('script', b'#! /bin/sh\n')
+		with self.assertRaises(efilepy.QueryError):
+			efilepy.elf_missing([ path ])
+
+	def test_lib_candidates(self):
+		def group(path, arch):
+			return dict(ver_groups = { '1.0': dict(path_groups = {
+				path: dict(arch = arch) }) })
+
+		result = {
+				'dev-libs/other': group('/opt/lib64/libfoo.so.1', [ 'amd64' ]),
+				'dev-libs/none': group('/usr/share/libfoo.so.1', [ 'x86' ]),
+				'dev-libs/best': group('/usr/lib64/libfoo.so.1', [ 'amd64' ]),
+				'dev-libs/dir': group('/lib64/libfoo.so.1', [ 'x86' ]),
+				'dev-libs/also': group('/usr/lib64/libfoo.so.1', [ 'x86' ]),
+		}
+		self.assertEqual([ 'dev-libs/best', 'dev-libs/also', 'dev-libs/dir',
+			'dev-libs/other', 'dev-libs/none' ],
+			efilepy.lib_candidates(result, 64, EM_X86_64))
+		# A 32-bit library belongs into lib or lib32
+		result['dev-libs/lib32'] = group('/usr/lib32/libfoo.so.1', [ 'x86' ])
+		self.assertEqual([ 'dev-libs/lib32', 'dev-libs/also', 'dev-libs/dir',
+			'dev-libs/none', 'dev-libs/best', 'dev-libs/other' ],
+			efilepy.lib_candidates(result, 32, 3))
+
+if '__main__' == __name__:
+	unittest.main()
@@ -0,0 +1,142 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# Timeouts, retries, the circuit breaker and the response cache of
+# efilepy.Session.fetch(), against a local stub server.
+
+import sys, os, json, time, tempfile, unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import efilepy
+from stubserver import StubServer
+
+ANSWER = json.dumps(dict(result = [ dict(category = 'sys-apps',
+	package = 'coreutils', version = '8.16', path = '/bin', file = 'du',
+	archs = [ 'amd64' ], useflags = [], type = [ 'obj' ]) ])).encode('utf-8')
+
+class FetchTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+
+	def session(self, stub, **kwargs):
+		conf = dict(source = 'pfl_json', base_url = stub.base_url,
+				cache_dir = self.tmp.name, timeout_connect = 2,
+				timeout_read = 2, deadline = 10, retries = 2,
+				retry_backoff = 0.01, retry_backoff_max = 0.01,
+				breaker_threshold = 0)
+		conf.update(kwargs)
+		session = efilepy.Session(**conf)
+		self.addCleanup(session.close)
+		return session
+
+	def find(self, session, filename = 'du'):
+		return session.lookup('uniq', session.make_query('uniq',
+			[ filename ]))
+
+	def test_hang_read_timeout(self):
+		with StubServer({ '': ANSWER }, latency = 5) as stub:
+			session = self.session(stub, timeout_read = 0.2, retries = 0,
+					cache = False)
+			start = time.monotonic()
+			with self.assertRaises(efilepy.FetchError):
+				self.find(session)
+			self.assertLess(time.monotonic() - start, 2)
+
+	def test_hang_deadline(self):
+		with StubServer({ '': ANSWER }, latency = 5) as stub:
+			session = self.session(stub, timeout_read = 0.3, deadline = 0.5,
+					retries = 10, cache = False)
+			start = time.monotonic()
+			with self.assertRaises(efilepy.FetchError):
+				self.find(session)
+			self.assertLess(time.monotonic() - start, 2)
+			self.assertLessEqual(stub.requests, 2)
+
+	def test_server_error_retried(self):
+		with StubServer({ '': (503, b'') }) as stub:
+			session = self.session(stub, cache = False)
+			with self.assertRaises(efilepy.FetchError) as cm:
+				self.find(session)
+			self.assertTrue(cm.exception.retriable)
+			self.assertEqual(3, stub.requests)
+
+	def test_not_found_not_retried(self):
+		with StubServer({ '': (404, b'') }) as stub:
+			session = self.session(stub, cache = False)
+			with self.assertRaises(efilepy.FetchError) as cm:
+				self.find(session)
+			self.assertFalse(cm.exception.retriable)
+			self.assertEqual(1, stub.requests)
+
+	def test_breaker_counts_queries(self):
+		with StubServer({ '': (503, b'') }) as stub:
+			session = self.session(stub, retries = 3, breaker_threshold = 2,
+					breaker_cooldown = 60)
+			with self.assertRaises(efilepy.FetchError):
+				self.find(session)
+			# A query of four attempts is a single failure
+			self.assertTrue(session.breaker_allow(
+				stub.base_url.split('//')[1]))
+			with self.assertRaises(efilepy.FetchError):
+				self.find(session)
+			self.assertEqual(8, stub.requests)
+			with self.assertRaisesRegex(efilepy.FetchError, 'breaker'):
+				self.find(session)
+			self.assertEqual(8, stub.requests)
+			# Kept in the cache directory for later invocations
+			with self.assertRaisesRegex(efilepy.FetchError, 'breaker'):
+				self.find(self.session(stub, breaker_threshold = 2,
+					breaker_cooldown = 60))
+			self.assertEqual(8, stub.requests)
+
+	def test_breaker_half_open_probe(self):
+		with StubServer({ '': (503, b'') }) as stub:
+			host = stub.base_url.split('//')[1]
+			session = self.session(stub, retries = 0, breaker_threshold = 1,
+					breaker_cooldown = 0.1)
+			with self.assertRaises(efilepy.FetchError):
+				self.find(session)
+			self.assertFalse(session.breaker_allow(host))
+			time.sleep(0.2)
+			self.assertTrue(session.breaker_allow(host))
+			self.assertFalse(session.breaker_allow(host))
+			session.breaker_record(host, True)
+			self.assertTrue(session.breaker_allow(host))
+			self.assertTrue(session.breaker_allow(host))
+
+	def test_stale_fallback(self):
+		with StubServer({ '': ANSWER }) as stub:
+			session = self.session(stub, cache_ttl = 0)
+			self.assertIn('sys-apps/coreutils', self.find(session))
+			stub.responses = { '': (503, b'') }
+			self.assertIn('sys-apps/coreutils', self.find(session))
+			self.assertEqual(1, session.stats['cache_stale'])
+
+	def test_bad_answer_not_cached(self):
+		with StubServer({ '': b'<html>Maintenance</html>' }) as stub:
+			session = self.session(stub)
+			with self.assertRaises(efilepy.ParseError):
+				self.find(session)
+			stub.responses = { '': ANSWER }
+			self.assertIn('sys-apps/coreutils', self.find(session))
+			self.assertEqual(0, session.stats['cache_hits'])
+			self.assertEqual(2, stub.requests)
+
+	def test_bad_answer_falls_back_to_stale(self):
+		with StubServer({ '': ANSWER }) as stub:
+			session = self.session(stub, cache_ttl = 0)
+			self.find(session)
+			stub.responses = { '': json.dumps(dict(error = dict(code = 1,
+				message = 'down'))).encode('utf-8') }
+			self.assertIn('sys-apps/coreutils', self.find(session))
+			self.assertEqual(1, session.stats['cache_stale'])
+			# The stale entry was not replaced by the error
+			session = self.session(stub, cache_ttl = 3600)
+			self.assertIn('sys-apps/coreutils', self.find(session))
+
+if '__main__' == __name__:
+	unittest.main()
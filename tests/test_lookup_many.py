@@ -0,0 +1,76 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# efilepy.Session.lookup_many() on request iterables that are slow or
+# never end, like a pipe feeding -B.
+
+import sys, os, json, threading, unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import efilepy
+from stubserver import StubServer
+
+ANSWER = json.dumps(dict(result = [ dict(category = 'sys-apps',
+	package = 'coreutils', version = '8.16', path = '/bin', file = 'du',
+	archs = [ 'amd64' ], useflags = [], type = [ 'obj' ]) ])).encode('utf-8')
+
+class LookupManyTest(unittest.TestCase):
+	def session(self, stub, **kwargs):
+		session = efilepy.Session(source = 'pfl_json', base_url = stub.base_url,
+				cache = False, **kwargs)
+		self.addCleanup(session.close)
+		return session
+
+	def test_results_before_end_of_input(self):
+		answered = threading.Event()
+
+		def requests():
+			yield 'uniq', [ 'du' ]
+			# Like stdin of a client waiting for the answer
+			self.assertTrue(answered.wait(5))
+			yield 'uniq', [ 'ls' ]
+
+		with StubServer({ '': ANSWER }) as stub:
+			results = self.session(stub).lookup_many(requests())
+			request, query, result = next(results)
+			self.assertEqual(('uniq', [ 'du' ]), request)
+			self.assertIn('sys-apps/coreutils', result)
+			answered.set()
+			self.assertEqual([ ('uniq', [ 'ls' ]) ],
+					[ request for request, query, result in results ])
+
+	def test_bounded(self):
+		read = [ 0 ]
+
+		def requests():
+			for i in range(50):
+				read[0] += 1
+				yield 'uniq', [ 'file{}'.format(i) ]
+
+		with StubServer({ '': ANSWER }, latency = 0.05) as stub:
+			results = self.session(stub, jobs = 2).lookup_many(requests())
+			next(results)
+			# Four in flight, and one read ahead
+			self.assertLessEqual(read[0], 2 * 2 + 2)
+			self.assertEqual(49, len(list(results)))
+
+	def test_errors(self):
+		def requests():
+			yield 'uniq', [ 'du' ]
+			yield 'cpvtof', [ 'foo' ]
+			raise OSError('Input gone')
+
+		with StubServer({ '': (503, b'') }) as stub:
+			results = list()
+			with self.assertRaisesRegex(OSError, 'Input gone'):
+				for rec in self.session(stub, retries = 0).lookup_many(
+						requests()):
+					results.append(rec)
+		self.assertTrue(all(isinstance(result, efilepy.Error)
+			for request, query, result in results))
+
+if '__main__' == __name__:
+	unittest.main()
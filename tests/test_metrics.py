@@ -0,0 +1,69 @@
+# Richard Grenville
+# https://github.com/richardgv/e-file-py
+# Distributed under the terms of the GNU General Public License v2+
+
+# The metrics file written by efilepy.Session.close(), with and without
+# the cache directory keeping the totals, and the JSON of --metrics.
+
+import sys, os, io, json, types, tempfile, contextlib, importlib.util
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import efilepy
+from stubserver import StubServer
+
+spec = importlib.util.spec_from_file_location('e_file_py',
+		os.path.join(ROOT, 'e-file-py.py'))
+cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cli)
+
+ANSWER = json.dumps(dict(result = [])).encode('utf-8')
+
+class MetricsTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		self.metrics_file = os.path.join(self.tmp.name, 'metrics.prom')
+
+	def run_lookups(self, stub, count, **kwargs):
+		'''Look up count files in a session and return the metrics file it
+		wrote when closed.'''
+		with efilepy.Session(source = 'pfl_json', base_url = stub.base_url,
+				cache_dir = self.tmp.name, metrics_file = self.metrics_file,
+				**kwargs) as session:
+			for i in range(count):
+				session.lookup('uniq', session.make_query('uniq',
+					[ 'file{}'.format(i) ]))
+		with open(self.metrics_file, 'r') as f:
+			return f.read()
+
+	def test_no_cache(self):
+		with StubServer({ '': ANSWER }) as stub:
+			text = self.run_lookups(stub, 2, cache = False)
+		self.assertIn('efilepy_requests_total 2\n', text)
+		self.assertIn('efilepy_lookups_total 2\n', text)
+		self.assertFalse(os.path.exists(os.path.join(self.tmp.name,
+			'stats.json')))
+
+	def test_totals_kept(self):
+		with StubServer({ '': ANSWER }) as stub:
+			self.run_lookups(stub, 2)
+			text = self.run_lookups(stub, 1)
+		self.assertIn('efilepy_lookups_total 3\n', text)
+
+	def test_json_bucket_order(self):
+		with efilepy.Session(cache = False) as session:
+			for value in (0.0001, 0.3, 20.0, 100.0):
+				session.observe('stage_seconds', value, stage = 'parse_result')
+			out = io.StringIO()
+			with contextlib.redirect_stdout(out):
+				cli.run_metrics(session, types.SimpleNamespace())
+		hist, = json.loads(out.getvalue())['histograms']['stage_seconds']
+		self.assertEqual([ str(le) for le in efilepy.METRIC_BUCKETS ]
+				+ [ '+Inf' ], list(hist['buckets']))
+		self.assertEqual(4, hist['buckets']['+Inf'])
+
+if '__main__' == __name__:
+	unittest.main()